@@ -8,15 +8,23 @@
 from simpful import *
 from copy import deepcopy
 from collections import defaultdict
-from platypus import NSGAII, Problem, Integer, ProcessPoolEvaluator
+from platypus import NSGAII, Problem, Integer, ProcessPoolEvaluator, Hypervolume
 from numpy import savetxt, array, linspace
+from simulation import Simulation_Mixin
+from perturbation_model import Perturbation_Model
+from optimization_tools import local_search, Front_Archive, Warm_Start, Hypervolume_Log, Hypervolume_Stagnation, Dedup_Evaluator, read_paretofront
 import matplotlib.pyplot as plt
 
-class Model_Simulator(object):
+class Model_Simulator(Simulation_Mixin):
 
-	def __init__(self, steps=100):
+	# Timepoint 0 is the state after the first inference step
+	_offset = 1
+
+	def __init__(self, steps=100, engine=None, perturbation_model="before_inference", **options):
 		# Set simulation steps
 		self._max_steps = steps
+		# Timepoint of the fitness readout (14, i.e. t>0.13, with 100 steps)
+		self._readout = int(round(14*(steps-1)/99.))
 
 		self.FS = FuzzySystem()
 
@@ -453,6 +461,9 @@ class Model_Simulator(object):
 
 		self.FS.add_rules(RULES)
 
+		# Variables updated by the inference (i.e., appearing in a consequent)
+		self._outputs = sorted(set(rule[1][0] for rule in self.FS._rules))
+
 		# Set initial state of the model
 		self._reset_variables()    
 
@@ -468,6 +479,17 @@ class Model_Simulator(object):
 		self._sorted_names.remove("ATP")
 		self._sorted_names.remove("Glycolysis")
 		print(" * Variables being perturbed:", self._sorted_names)
+
+		# Semantics of the clamps ("before_inference" or "after_update", see
+		# perturbation_model.PERTURBATION_MODELS)
+		self._perturbation_model = Perturbation_Model(self.FS, self._sorted_names, perturbation_model)
+
+		# Glucose schedule
+		self._time_function = time_function
+
+		# Set inference engine
+		self.set_engine(engine, **options)
+		self._batch = None
         
 	def _reset_variables(self):
 		self.FS.set_variable("Glucose", 1.0)
@@ -497,37 +519,24 @@ class Model_Simulator(object):
 		self.FS.set_variable("RasGTP", 1.0)
 
 
-	def simulate(self, perturbation=None):
-		# Simulate the model with a perturbation
-		dynamics = defaultdict(list)
-		self._reset_variables()
-		for T in linspace(0, 1, self._max_steps):
-		    self.FS.set_variable("Glucose", time_function(T))
-		    
-		    for k,v in zip(self._sorted_names, perturbation):
-		    	if v==1: #low
-		    		self.FS.set_variable(k, 0.0)		    		
-		    	elif v==2: #high
-		    		self.FS.set_variable(k, 1.0)
-
-		    new_values = self.FS.Sugeno_inference()
-
-		    self.FS._variables.update(new_values)
-
-		    for var in new_values.keys():          
-		        dynamics[var].append(new_values[var])
-
-		return dynamics
-
 	def fitness(self, x, SIM=None):
 		# Calculate fitness of the perturbation
-		result = self.simulate(perturbation=x)
+		result = self.simulate(perturbation=x, record=(["Apoptosis"], [0, self._readout]))
 		begin_apo = result['Apoptosis'][0]
-		end_apo = result['Apoptosis'][14] # t>0.13
+		end_apo = result['Apoptosis'][self._readout] # t>0.13
 		complexity = len(list(filter(lambda y: y>0, x)))
 		print(x, "%.3f, %d" % (end_apo-begin_apo, complexity))
 		return end_apo-begin_apo, complexity
 
+	def fitness_batch(self, perturbations):
+		# Fitness of many perturbations at once, simulated with simulate_batch()
+		values = self.simulate_batch(perturbations, (["Apoptosis"], [0, self._readout]))
+		fitness = []
+		for x, v in zip(perturbations, values.tolist()):
+			complexity = len(list(filter(lambda y: y>0, x)))
+			fitness.append((v[1][0]-v[0][0], complexity))
+		return fitness
+
 def time_function(curtime):
 	if curtime<0.075: 
 		return 1
@@ -565,6 +574,14 @@ if __name__ == '__main__':
 	FEs = 10000
 	POPSIZE = 100
 	DIRECTIONS = [Problem.MAXIMIZE, Problem.MINIMIZE]
+	# Hamming-1 local search on the final population (see optimization_tools.local_search)
+	LOCAL_SEARCH = False
+	# Seed the initial population with the fronts of earlier runs of the same model (see optimization_tools.Front_Archive)
+	WARM_START = False
+	# Stop when the hypervolume stagnates instead of after FEs (see optimization_tools.Hypervolume_Stagnation)
+	STAGNATION = False
+	# Evaluate the identical offspring of a generation once (see optimization_tools.Dedup_Evaluator)
+	DEDUP = False
 
 	print(" * %d variables, %d objectives" % (D,OBJS))
 	print(" * %d individuals, MAX_FEs %d, %d iterations" % (POPSIZE, FEs, FEs//POPSIZE)) 
@@ -574,10 +591,36 @@ if __name__ == '__main__':
 	problem.function = SIM.fitness
 	problem.directions[:] = DIRECTIONS
 	
+	options, termination = {}, FEs
+	if STAGNATION:
+		termination = Hypervolume_Stagnation(FEs, Hypervolume(minimum=[-1.0, 0], maximum=[1.0, 16]))
+	# Every run is archived with its hypervolume history; the first unseeded run is the reference of the warm starts
+	ARCHIVE = Front_Archive(SIM)
+	callback = Hypervolume_Log(Hypervolume(minimum=[-1.0, 0], maximum=[1.0, 16]))
+	seeds = []
+	if WARM_START:
+		seeds = ARCHIVE.genotypes()
+		if not seeds:
+			# Front written before the archive existed (not checked against the model hash)
+			seeds = read_paretofront("result-paretofront.txt", SIM._sorted_names)
+		print(" * Warm start from %d archived perturbations" % len(seeds))
+		if seeds:
+			options["generator"] = Warm_Start(seeds, POPSIZE)
+
 	# Multi-processing (4 parallel processes)
 	with ProcessPoolEvaluator(4) as evaluator:
-		algorithm = NSGAII(problem, population_size = POPSIZE, evaluator=evaluator)
-		res = algorithm.run(FEs)
+		if DEDUP:
+			evaluator = Dedup_Evaluator(evaluator, verbose=True)
+		algorithm = NSGAII(problem, population_size = POPSIZE, evaluator=evaluator, **options)
+		res = algorithm.run(termination, callback=callback)
+	if DEDUP:
+		evaluator.report()
+	if LOCAL_SEARCH:
+		local_search(algorithm, SIM.fitness_batch, verbose=True)
+	if seeds:
+		ARCHIVE.report(callback.history)
+	ARCHIVE.update(algorithm.result, callback.history, seeded=bool(seeds))
+	ARCHIVE.save()
 
 	final_results = [(s.objectives[0], s.objectives[1]) for s in algorithm.result]
 	final_solutions = []
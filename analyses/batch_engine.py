@@ -0,0 +1,341 @@
+#########################################################################################################
+# Batched simulation of the dynamic fuzzy models: the whole simulate() loop (Glucose schedule,
+# perturbation clamps and Sugeno inference) runs over many perturbations at once, on a program
+# of flat arrays built from fuzzy_engine.Compiled_Model. Two backends run the same program:
+# "numba" JIT-compiles the loop into native code (only if numba is installed), "numpy"
+# vectorizes each step over the perturbations.
+#########################################################################################################
+
+from numpy import add, argsort, array, asarray, clip, empty, full, int64, isnan, float32, float64, maximum, minimum, unique, where, zeros
+from fuzzy_engine import Compiled_Model
+from perturbation_model import PERTURBATION_MODELS
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# Backends in order of preference
+BACKENDS = ("numba", "numpy")
+
+# Precisions: dtype of states, memberships and trajectories, dtype of the
+# sums of the Sugeno weighted averages
+PRECISIONS = {"double": (float64, float64), "single": (float32, float32), "mixed": (float32, float64)}
+
+# Operator codes of the program
+OPCODES = {"NOT": 0, "AND": 1, "OR": 2, "AND_p": 3, "OR_p": 4}
+
+
+def available_backends():
+    return [backend for backend in BACKENDS if backend!="numba" or njit is not None]
+
+
+class Batch_Simulator(object):
+
+    def __init__(self, FS, perturbed, glucose, backend=None, lookup=None, resolution=1000, precision="double",
+            perturbation_model="before_inference"):
+        # FS holds the initial state in FS._variables; perturbed lists the
+        # variables set by a perturbation (in the order of its genes); glucose
+        # is the level of Glucose at each step (i.e., time_function over the
+        # time grid of the simulation). lookup="interpolate"/"nearest"
+        # fuzzifies from tables (see Compiled_Model.error_bound); precision
+        # is one of PRECISIONS (see set_precision); perturbation_model is one
+        # of perturbation_model.PERTURBATION_MODELS
+        if perturbation_model not in PERTURBATION_MODELS:
+            raise Exception("ERROR: unknown perturbation model '%s', available models: %s" % (perturbation_model, ", ".join(PERTURBATION_MODELS)))
+        self.perturbation_model = perturbation_model
+        self._after_update = perturbation_model=="after_update"
+        model = Compiled_Model(FS, sparse=False, cse=True, reduce=True, lookup=lookup, resolution=resolution)
+        self.lookup = lookup
+        self.resolution = resolution
+        self.error_bound = model.error_bound()
+        self.variables = model.variables
+        self.outputs = model.outputs
+        self.initial = array([FS._variables[var] for var in self.variables], dtype=float64)
+        self.perturbed = array([model._var_index[var] for var in perturbed], dtype=int64)
+        self.glucose = array(glucose, dtype=float64)
+        self._glucose_index = model._var_index["Glucose"]
+        self._compile(model)
+        self.set_precision(precision)
+        self.set_backend(backend)
+
+    def set_backend(self, backend=None):
+        # Select a backend (None: the fastest available). A backend whose
+        # library is not installed falls back to NumPy; self.backend reports
+        # the one in use
+        if backend is None:
+            backend = available_backends()[0]
+        if backend not in BACKENDS:
+            raise Exception("ERROR: unknown backend '%s', available backends: %s" % (backend, ", ".join(BACKENDS)))
+        if backend not in available_backends():
+            print(" * Backend %s is not available, falling back to numpy" % backend)
+            backend = "numpy"
+        self.backend = backend
+
+    def set_precision(self, precision="double"):
+        # "double": float64 everywhere; "single": float32 everywhere, halving
+        # the memory of states and trajectories; "mixed": float32 states and
+        # memberships, float64 sums of the weighted averages. See deviation()
+        if precision not in PRECISIONS:
+            raise Exception("ERROR: unknown precision '%s', available precisions: %s" % (precision, ", ".join(PRECISIONS)))
+        self.precision = precision
+        self.dtype, self.accumulator = PRECISIONS[precision]
+        self._arrays = {}
+        for name in ("initial", "glucose", "_low", "_high", "_first", "_x0", "_x1", "_y0", "_slope", "_tables"):
+            self._arrays[name] = getattr(self, name).astype(self.dtype)
+        for name in ("_rule_crisp", "_rule_weight", "_rule_mult", "_sorted_factors", "_sorted_mult"):
+            self._arrays[name] = getattr(self, name).astype(self.accumulator)
+
+    def deviation(self, perturbations, record=None):
+        # Deviation of the trajectories in the current precision from float64:
+        # largest and mean absolute difference, and memory of the trajectories
+        # in both precisions
+        precision = self.precision
+        trajectories = self.simulate(perturbations, record=record)
+        self.set_precision("double")
+        try:
+            reference = self.simulate(perturbations, record=record)
+        finally:
+            self.set_precision(precision)
+        difference = abs(trajectories.astype(float64)-reference)
+        return {"max": float(difference.max()), "mean": float(difference.mean()),
+            "bytes": trajectories.nbytes, "double_bytes": reference.nbytes}
+
+    def _compile(self, model):
+        # Program of flat arrays: slots 0..T-1 hold the membership degrees of
+        # the terms, the following ones the operators of the DAG (children
+        # always have lower slots than their parents)
+        terms = model.referenced_terms()
+        segments = max(len(model._segments[t]) for t in terms)
+        self._term_slots = array(terms, dtype=int64)
+        self._term_var = array([model._term_var[t] for t in terms], dtype=int64)
+        self._low = array([model._boundaries[t][0] for t in terms], dtype=float64)
+        self._high = array([model._boundaries[t][1] for t in terms], dtype=float64)
+        self._first = array([model._segments[t][0][0] for t in terms], dtype=float64)
+        # Padding segments are empty (x0>x1), so that they never match
+        self._x0, self._x1 = full((len(terms), segments), 1.0), full((len(terms), segments), 0.0)
+        self._y0, self._slope = zeros((len(terms), segments)), zeros((len(terms), segments))
+        for i, t in enumerate(terms):
+            for s, (x0, y0, x1, y1) in enumerate(model._segments[t]):
+                if x1>x0:
+                    self._x0[i,s], self._x1[i,s], self._y0[i,s], self._slope[i,s] = x0, x1, y0, (y1-y0)/(x1-x0)
+        self._mode = {None: 0, "interpolate": 1, "nearest": 2}[model.lookup]
+        self._tables = array([model._tables[t] for t in terms]) if model.lookup is not None else zeros((len(terms), 2))
+        self._rows = array(range(len(terms)), dtype=int64)
+
+        slot = {n: node[1] for n, node in enumerate(model._nodes) if node[0]=="IS"}
+        operators = [n for n in sorted(model._reachable()) if model._nodes[n][0]!="IS"]
+        level = {}
+        for i, n in enumerate(operators):
+            slot[n] = len(model.terms)+i
+            node = model._nodes[n]
+            level[n] = 1 + max(level.get(child, 0) for child in node[1:])
+        self.slots = len(model.terms)+len(operators)
+        self._op = array([OPCODES[model._nodes[n][0]] for n in operators], dtype=int64)
+        self._a = array([slot[model._nodes[n][1]] for n in operators], dtype=int64)
+        self._b = array([slot[model._nodes[n][-1]] for n in operators], dtype=int64)
+        self._dst = array([slot[n] for n in operators], dtype=int64)
+
+        # Operators grouped by level and type, for the vectorized backend
+        self._levels = []
+        for l in sorted(set(level.values())):
+            for op in OPCODES.values():
+                group = [i for i, n in enumerate(operators) if level[n]==l and self._op[i]==op]
+                if group:
+                    self._levels.append((op, self._a[group], self._b[group], self._dst[group]))
+
+        # Rules, in the order of the rule base
+        self._rule_slot = array([slot[rule[0]] for rule in model.rules], dtype=int64)
+        self._rule_out = array([rule[1] for rule in model.rules], dtype=int64)
+        self._rule_crisp = array([rule[2] for rule in model.rules], dtype=float64)
+        self._rule_weight = array([rule[3] for rule in model.rules], dtype=float64)
+        self._rule_mult = array([rule[4] for rule in model.rules], dtype=float64)
+        self._outputs = array([model._var_index[var] for var in self.outputs], dtype=int64)
+
+        # Rules sorted by output, for the vectorized sums of the backend numpy
+        order = argsort(self._rule_out, kind="stable")
+        self._sorted_slots = self._rule_slot[order]
+        self._sorted_factors = (self._rule_crisp*self._rule_weight)[order]
+        self._sorted_mult = self._rule_mult[order]
+        self._sorted_outputs, self._starts = unique(self._rule_out[order], return_index=True)
+
+    def _clamps(self, perturbations):
+        # Matrix of the values of the perturbed variables (nan: not clamped)
+        codes = asarray(perturbations, dtype=int64).reshape(-1, len(self.perturbed))
+        return where(codes==1, 0.0, where(codes==2, 1.0, float("nan")))
+
+    def simulate(self, perturbations, record=None, steps=None):
+        # Simulate each perturbation (list of genes: 0 unperturbed, 1 low,
+        # 2 high) for `steps` steps (default: the length of the Glucose
+        # schedule). Returns an array (perturbations, recorded steps, variables)
+        # with the states at the steps in `record` (default: all), where step 0
+        # is the initial state and step k the state after k inference steps
+        if steps is None:
+            steps = len(self.glucose)
+        if record is None:
+            record = range(steps+1)
+        record = list(record)
+        if max(record)>steps or len(self.glucose)<steps:
+            raise Exception("ERROR: cannot record step %d of a simulation of %d steps" % (max(record), steps))
+        positions = full(steps+1, -1, dtype=int64)
+        positions[record] = range(len(record))
+        clamps = self._clamps(perturbations).astype(self.dtype)
+        trajectories = empty((len(clamps), len(record), len(self.variables)), dtype=self.dtype)
+        P = self._arrays
+        if self.backend=="numba":
+            _simulate_jit(P["initial"], self.perturbed, clamps, self._after_update, P["glucose"], self._glucose_index, steps, positions,
+                self._term_slots, self._term_var, P["_low"], P["_high"], P["_first"], P["_x0"], P["_x1"], P["_y0"], P["_slope"],
+                self._mode, P["_tables"], self.resolution,
+                self._op, self._a, self._b, self._dst,
+                self._rule_slot, self._rule_out, P["_rule_crisp"], P["_rule_weight"], P["_rule_mult"], self._outputs,
+                empty(len(self.variables), dtype=self.dtype), zeros(self.slots, dtype=self.dtype),
+                zeros(len(self.variables), dtype=self.accumulator), zeros(len(self.variables), dtype=self.accumulator),
+                trajectories)
+        else:
+            self._simulate_numpy(clamps, steps, positions, trajectories)
+        return trajectories
+
+    def _simulate_numpy(self, clamps, steps, positions, trajectories):
+        P = self._arrays
+        X = zeros((len(clamps), len(self.variables)), dtype=self.dtype)
+        X[:] = P["initial"]
+        clamped = ~isnan(clamps)
+        if positions[0]>=0:
+            trajectories[:, positions[0]] = X
+        mu = zeros((len(X), self.slots), dtype=self.dtype)
+        for k in range(1, steps+1):
+            self._step_numpy(X, mu, clamped, clamps, P["glucose"][k-1])
+            if positions[k]>=0:
+                trajectories[:, positions[k]] = X
+
+    def step(self, states, perturbations, glucose):
+        # One inference step of each state (array (perturbations, variables),
+        # in the order of self.variables) under its perturbation, with Glucose
+        # at `glucose`, vectorized over the perturbations whatever the backend
+        # (e.g., for the steady states). Returns the new states
+        clamps = self._clamps(perturbations).astype(self.dtype)
+        X = asarray(states, dtype=self.dtype).copy()
+        self._step_numpy(X, zeros((len(X), self.slots), dtype=self.dtype), ~isnan(clamps), clamps, glucose)
+        return X
+
+    def _step_numpy(self, X, mu, clamped, clamps, glucose):
+        # One step of the states X in place (mu: work array of the memberships)
+        P = self._arrays
+        X[:, self._glucose_index] = glucose
+        X[:, self.perturbed] = where(clamped, clamps, X[:, self.perturbed])
+
+        x = X[:, self._term_var]
+        mu[:, self._term_slots] = self._memberships(x) if self.lookup is None else self._table_memberships(x)
+
+        for op, a, b, dst in self._levels:
+            if op==0:
+                mu[:, dst] = 1.-mu[:, a]
+            elif op==1:
+                mu[:, dst] = minimum(mu[:, a], mu[:, b])
+            elif op==2:
+                mu[:, dst] = maximum(mu[:, a], mu[:, b])
+            elif op==3:
+                mu[:, dst] = mu[:, a]*mu[:, b]
+            else:
+                mu[:, dst] = mu[:, a]+mu[:, b]-mu[:, a]*mu[:, b]
+
+        strengths = mu[:, self._sorted_slots]
+        num = add.reduceat(strengths*P["_sorted_factors"], self._starts, axis=1)
+        den = add.reduceat(strengths*P["_sorted_mult"], self._starts, axis=1)
+        X[:, self._sorted_outputs] = where(den!=0.0, num/where(den!=0.0, den, 1.0), 0.0)
+        if self._after_update:
+            X[:, self.perturbed] = where(clamped, clamps, X[:, self.perturbed])
+
+    def _memberships(self, x):
+        # Memberships of the values x (column j: variable of term j): first
+        # segment containing the value, constants outside
+        P = self._arrays
+        value = zeros(x.shape, dtype=x.dtype) + P["_high"]
+        for s in reversed(range(self._x0.shape[1])):
+            inside = (x>=P["_x0"][:, s]) & (x<=P["_x1"][:, s])
+            value = where(inside, P["_y0"][:, s] + (x-P["_x0"][:, s]) * P["_slope"][:, s], value)
+        return where(x<P["_first"], P["_low"], value)
+
+    def _table_memberships(self, x):
+        # Memberships from the lookup tables: one index computation and a gather
+        tables = self._arrays["_tables"]
+        position = clip(x, 0.0, 1.0)*self.resolution
+        if self.lookup=="nearest":
+            value = tables[self._rows, (position+0.5).astype(int64)]
+        else:
+            i = position.astype(int64)
+            low = tables[self._rows, i]
+            value = low + (position-i)*(tables[self._rows, i+1]-low)
+        inside = (x>=0.0) & (x<=1.0)
+        return value if inside.all() else where(inside, value, self._memberships(x))
+
+
+def _simulate_loop(initial, perturbed, clamps, after_update, glucose, glucose_index, steps, positions,
+        term_slots, term_var, low, high, first, x0, x1, y0, slope,
+        mode, tables, resolution,
+        op, a, b, dst,
+        rule_slot, rule_out, rule_crisp, rule_weight, rule_mult, outputs,
+        X, mu, num, den, trajectories):
+    # One perturbation at a time, with the same operations (and order of the
+    # sums) as FS.Sugeno_inference(). X (state) and mu (memberships) are work
+    # arrays in the precision of the states, num and den in that of the sums
+    V = len(initial)
+    T = len(term_var)
+    for i in range(clamps.shape[0]):
+        for v in range(V):
+            X[v] = initial[v]
+        if positions[0]>=0:
+            trajectories[i, positions[0], :] = X
+        for k in range(1, steps+1):
+            X[glucose_index] = glucose[k-1]
+            for p in range(len(perturbed)):
+                if clamps[i, p]==clamps[i, p]:
+                    X[perturbed[p]] = clamps[i, p]
+            for t in range(T):
+                value = X[term_var[t]]
+                if mode>0 and 0.0<=value and value<=1.0:
+                    position = value*resolution
+                    if mode==2:
+                        m = tables[t, int(position+0.5)]
+                    else:
+                        j = int(position)
+                        m = tables[t, j] + (position-j)*(tables[t, j+1]-tables[t, j])
+                elif value<first[t]:
+                    m = low[t]
+                else:
+                    m = high[t]
+                    for s in range(x0.shape[1]):
+                        if x0[t, s]<=value and value<=x1[t, s]:
+                            m = y0[t, s] + (value-x0[t, s]) * slope[t, s]
+                            break
+                mu[term_slots[t]] = m
+            for j in range(len(op)):
+                if op[j]==0:
+                    mu[dst[j]] = 1.-mu[a[j]]
+                elif op[j]==1:
+                    mu[dst[j]] = min(mu[a[j]], mu[b[j]])
+                elif op[j]==2:
+                    mu[dst[j]] = max(mu[a[j]], mu[b[j]])
+                elif op[j]==3:
+                    mu[dst[j]] = mu[a[j]]*mu[b[j]]
+                else:
+                    mu[dst[j]] = mu[a[j]]+mu[b[j]]-mu[a[j]]*mu[b[j]]
+            for v in outputs:
+                num[v] = 0.0
+                den[v] = 0.0
+            for r in range(len(rule_slot)):
+                value = mu[rule_slot[r]]
+                num[rule_out[r]] += value*rule_crisp[r]*rule_weight[r]
+                den[rule_out[r]] += value*rule_mult[r]
+            for v in outputs:
+                X[v] = num[v]/den[v] if den[v]!=0.0 else 0.0
+            if after_update:
+                for p in range(len(perturbed)):
+                    if clamps[i, p]==clamps[i, p]:
+                        X[perturbed[p]] = clamps[i, p]
+            if positions[k]>=0:
+                trajectories[i, positions[k], :] = X
+
+
+_simulate_jit = njit(cache=True)(_simulate_loop) if njit is not None else None
@@ -0,0 +1,111 @@
+#########################################################################################################
+# Regression check of optimization_tools on a short budget: the runs with the estimating
+# evaluators (Surrogate_Evaluator, Multi_Fidelity_Evaluator, with and without Dedup_Evaluator)
+# must return only simulated solutions, and Fitness_Cache, Front_Archive and Warm_Start must
+# give back what was stored. Run as a script; it stops at the first failed assertion.
+#########################################################################################################
+
+import random
+from shutil import rmtree
+from tempfile import mkdtemp
+from numpy import allclose, array
+from platypus import NSGAII, Problem, Integer, MapEvaluator, Hypervolume
+from optimization_tools import (Surrogate_Evaluator, Multi_Fidelity_Evaluator, Dedup_Evaluator, Final_Simulation,
+    Fitness_Cache, Front_Archive, Warm_Start, Hypervolume_Log, decode, estimated)
+
+
+def make_problem(SIM):
+    problem = Problem(len(SIM._sorted_names), 3)
+    problem.types[:] = [Integer(0,2) for _ in range(len(SIM._sorted_names))]
+    problem.function = SIM.fitness
+    problem.directions[:] = [Problem.MINIMIZE, Problem.MINIMIZE, Problem.MINIMIZE]
+    return problem
+
+
+def check_run(SIM, COARSE, surrogate, multi_fidelity, dedup, FEs, POPSIZE, seed=1):
+    # One run with the evaluators chained as in the comparison scripts: no
+    # member of the result is estimated, and its objectives are those of SIM
+    random.seed(seed)
+    evaluator = MapEvaluator()
+    if surrogate:
+        evaluator = Surrogate_Evaluator(evaluator, retrain_interval=POPSIZE, exploration=0.1, seed=seed)
+    if multi_fidelity:
+        evaluator = Multi_Fidelity_Evaluator(evaluator, COARSE.fitness_batch)
+    if dedup:
+        evaluator = Dedup_Evaluator(evaluator)
+    algorithm = NSGAII(make_problem(SIM), population_size=POPSIZE, evaluator=evaluator)
+    # Estimated members of the population, generation by generation
+    counts = []
+    algorithm.run(Final_Simulation(FEs), callback=lambda a: counts.append(sum(estimated(s) for s in a.population)))
+
+    assert not any(estimated(s) for s in algorithm.result), "estimated solutions in the result"
+    objectives = array([list(s.objectives) for s in algorithm.result])
+    assert allclose(objectives, SIM.fitness_batch([decode(s) for s in algorithm.result])), "objectives not simulated"
+    if surrogate or multi_fidelity:
+        assert max(counts)>0, "no estimated solutions during the run"
+    print(" * surrogate=%s multi_fidelity=%s dedup=%s: %d FEs, %d solutions simulated, up to %d estimated during the run" % (
+        surrogate, multi_fidelity, dedup, algorithm.nfe, len(algorithm.result), max(counts)))
+    return algorithm
+
+
+def check_fitness_cache(SIM, genotypes, cache_dir):
+    # Genotypes simulated once, then read back from the saved cache
+    cache = Fitness_Cache(SIM, cache_dir)
+    values = cache(genotypes)
+    assert cache.misses==len(set(map(tuple, genotypes))), "genotypes not simulated once each"
+    cache.save()
+
+    cache = Fitness_Cache(SIM, cache_dir)
+    assert len(cache)==len(set(map(tuple, genotypes))), "cache not saved"
+    assert allclose(cache(genotypes), values), "cached objectives differ"
+    assert cache.misses==0 and cache.hits==len(genotypes), "cache round-trip missed"
+    print(" * Fitness cache: %d genotypes saved and read back, %d hits" % (len(cache), cache.hits))
+
+
+def check_front_archive(SIM, algorithm, history, cache_dir, POPSIZE):
+    # The front of a run saved, read back, and used to warm start a run
+    archive = Front_Archive(SIM, cache_dir)
+    archive.update(algorithm.result, history)
+    archive.save()
+
+    stored = Front_Archive(SIM, cache_dir)
+    assert stored.genotypes()==archive.genotypes(), "archive not saved"
+    assert allclose(stored._objectives, SIM.fitness_batch(stored.genotypes())), "archived objectives not simulated"
+    assert stored.reference is not None and stored.reference.tolist()==[list(h) for h in history], "reference history not saved"
+
+    generator = Warm_Start(stored.genotypes(), POPSIZE, seed=1)
+    problem = make_problem(SIM)
+    population = [decode(generator.generate(problem)) for _ in range(POPSIZE)]
+    archived = set(map(tuple, stored.genotypes()))
+    seeded = sum(tuple(g) in archived for g in population[:min(len(archived), POPSIZE//2)])
+    assert seeded==min(len(archived), POPSIZE//2), "warm start did not seed the archived genotypes"
+    print(" * Front archive: %d genotypes saved and read back, %d seeds in the initial population" % (len(stored), seeded))
+
+
+if __name__ == '__main__':
+
+    from three_obj_optimization_programmed_cell_death_comparison import Model_Simulator
+    from batch_engine import available_backends
+
+    SIM = Model_Simulator()
+    SIM.set_backend(available_backends()[0])
+    COARSE = Model_Simulator(steps=50)
+
+    FEs = 1500
+    POPSIZE = 100
+
+    for surrogate, multi_fidelity, dedup in [(True, False, False), (False, True, False), (False, False, True), (True, True, True)]:
+        check_run(SIM, COARSE, surrogate, multi_fidelity, dedup, FEs, POPSIZE)
+
+    cache_dir = mkdtemp()
+    try:
+        random.seed(1)
+        algorithm = NSGAII(make_problem(SIM), population_size=POPSIZE)
+        log = Hypervolume_Log(Hypervolume(minimum=[-1.0, -1.0, 0], maximum=[1.0, 1.0, 16]))
+        algorithm.run(FEs, callback=log)
+        check_fitness_cache(SIM, [decode(s) for s in algorithm.result], cache_dir)
+        check_front_archive(SIM, algorithm, log.history, cache_dir, POPSIZE)
+    finally:
+        rmtree(cache_dir)
+
+    print(" * All checks passed")
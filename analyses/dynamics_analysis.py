@@ -0,0 +1,115 @@
+#########################################################################################################
+# Long-run analysis of the dynamic fuzzy models simulated by Model_Simulator:
+# attractor detection over the states yielded by Model_Simulator.stream(), so that
+# long horizons are never stored in memory, and accelerated steady-state solvers.
+#########################################################################################################
+
+from itertools import islice
+from numpy import arange, asarray, clip, finfo, inf, int64, matmul, minimum, ones, zeros
+from numpy.linalg import norm, pinv
+
+
+def _quantize(state, tolerance):
+    # Hashable key of a state, with values binned at the given tolerance
+    return tuple(int(round(state[var]/tolerance)) for var in sorted(state))
+
+
+def detect_attractor(stream, tolerance=1e-9):
+    # Brent's cycle detection over the states of a stream: only the last
+    # power-of-two checkpoint is kept, and the simulation stops as soon as a
+    # (quantized) state repeats. One period of the attractor is then collected.
+    # Returns a dictionary with the type of attractor ("fixed point",
+    # "limit cycle" or None if the horizon ends first), its period, its states
+    # and the last timepoint that was simulated
+    states = iter(stream)
+    n, state = next(states)
+    checkpoint = _quantize(state, tolerance)
+    power = period = 1
+    for n, state in states:
+        key = _quantize(state, tolerance)
+        if key==checkpoint:
+            break
+        if period==power:
+            checkpoint, power, period = key, power*2, 0
+        period += 1
+    else:
+        return {"attractor": None, "period": None, "states": [], "timepoint": n}
+
+    cycle = [state] + [s for _, s in islice(states, period-1)]
+    return {"attractor": "fixed point" if period==1 else "limit cycle",
+            "period": period,
+            "states": cycle,
+            "timepoint": n+len(cycle)-1}
+
+
+def anderson_fixed_point(step, x0, memory=5, delay=8, tolerance=1e-9, max_iterations=1000, max_fallbacks=3):
+    # Solve x = step(x) for one system with anderson_fixed_point_batch.
+    # Returns (x, iterations, converged, fallbacks)
+    x, iterations, converged, fallbacks = anderson_fixed_point_batch(lambda X, rows: asarray(step(X[0]), dtype=float)[None],
+        asarray(x0, dtype=float)[None], memory=memory, delay=delay, tolerance=tolerance, max_iterations=max_iterations,
+        max_fallbacks=max_fallbacks)
+    return x[0], int(iterations[0]), bool(converged[0]), int(fallbacks[0])
+
+
+def anderson_fixed_point_batch(step, X0, memory=5, delay=8, tolerance=1e-9, max_iterations=1000, max_fallbacks=3):
+    # Solve x = step(x) for many systems at once with Anderson acceleration
+    # over the last `memory` iterates (memory=0 is plain fixed-point
+    # iteration): X0 is an array (systems, dimensions) and step(X, rows)
+    # returns the images of the states X of the systems `rows` (e.g., one
+    # batched inference step). The first `delay` iterations are plain: in DFMs
+    # plain iteration often lands exactly on the fixed point within a few
+    # steps, and acceleration only pays off on the slowly converging ones.
+    # States are clipped to the [0, 1] universe of discourse. If an accelerated
+    # iterate increases the residual, it is discarded together with the
+    # history and a plain iteration is taken instead; after max_fallbacks of
+    # these, only plain iteration is used. Each system keeps its own history,
+    # iterations and fallbacks, and leaves the batch as soon as it converges.
+    # The least squares of all the accelerated systems are solved at once with
+    # a stacked pseudo-inverse (unused history columns are zero).
+    # Returns (X, iterations, converged, fallbacks), one row/entry per system;
+    # iterations counts the evaluations of step
+    x = clip(asarray(X0, dtype=float), 0, 1)
+    n = len(x)
+    everyone = arange(n)
+    g = step(x, everyone)
+    f = g-x
+    iterations = ones(n, dtype=int64)
+    fallbacks = zeros(n, dtype=int64)
+    history = zeros(n, dtype=int64)
+    dG, dF = zeros((n, x.shape[1], memory)), zeros((n, x.shape[1], memory))
+    slot = 0
+    residual = norm(f, inf, axis=1)
+    while True:
+        active = everyone[(residual>tolerance) & (iterations<max_iterations)]
+        if len(active)==0:
+            break
+        accelerated = (history[active]>0) & (iterations[active]>delay) & (fallbacks[active]<max_fallbacks)
+        x_new = g[active].copy()
+        if accelerated.any():
+            rows = active[accelerated]
+            gamma = matmul(pinv(dF[rows], rcond=finfo(float).eps*max(x.shape[1], memory)), f[rows][:, :, None])
+            x_new[accelerated] = clip(g[rows]-matmul(dG[rows], gamma)[:, :, 0], 0, 1)
+        g_new = step(x_new, active)
+        f_new = g_new-x_new
+        iterations[active] += 1
+
+        diverged = accelerated & ~(norm(f_new, inf, axis=1)<residual[active])
+        if diverged.any():
+            # Acceleration diverged: fall back to a plain iteration
+            rows = active[diverged]
+            fallbacks[rows] += 1
+            history[rows] = 0
+            dG[rows], dF[rows] = 0.0, 0.0
+            x_new[diverged] = g[rows]
+            g_new[diverged] = step(x_new[diverged], rows)
+            f_new[diverged] = g_new[diverged]-x_new[diverged]
+            iterations[rows] += 1
+
+        if memory>0:
+            dG[active, :, slot] = g_new-g[active]
+            dF[active, :, slot] = f_new-f[active]
+            slot = (slot+1)%memory
+            history[active] = minimum(history[active]+1, memory)
+        x[active], g[active], f[active] = x_new, g_new, f_new
+        residual[active] = norm(f_new, inf, axis=1)
+    return g, iterations, residual<=tolerance, fallbacks
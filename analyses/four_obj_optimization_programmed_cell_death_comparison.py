@@ -8,16 +8,21 @@
 from simpful import *
 from copy import deepcopy
 from collections import defaultdict
-from platypus import NSGAII, NSGAIII, SPEA2, Problem, Integer, ProcessPoolEvaluator, experiment, Hypervolume, calculate, display
+from platypus import NSGAII, NSGAIII, SPEA2, Problem, Integer, ProcessPoolEvaluator, MapEvaluator, experiment, Hypervolume, calculate, display
 from numpy import savetxt, array, linspace
+from simulation import Simulation_Mixin
+from perturbation_model import Perturbation_Model
+from optimization_tools import Surrogate_Evaluator, Multi_Fidelity_Evaluator, Dedup_Evaluator, Hypervolume_Stagnation, Final_Simulation
 import matplotlib.pyplot as plt
 from mpl_toolkits import mplot3d
 
-class Model_Simulator(object):
+class Model_Simulator(Simulation_Mixin):
 
-    def __init__(self, steps=100):
+    def __init__(self, steps=100, engine=None, perturbation_model="before_inference", **options):
         # Set simulation steps
         self._max_steps = steps
+        # Timepoint of the fitness readout (14, i.e. t>0.13, with 100 steps)
+        self._readout = int(round(14*(steps-1)/99.))
 
         self.FS = FuzzySystem()
 
@@ -454,6 +459,9 @@ class Model_Simulator(object):
 
         self.FS.add_rules(RULES)
 
+        # Variables updated by the inference (i.e., appearing in a consequent)
+        self._outputs = sorted(set(rule[1][0] for rule in self.FS._rules))
+
         # Set initial state of the model
         self._reset_variables()    
 
@@ -469,6 +477,17 @@ class Model_Simulator(object):
         self._sorted_names.remove("ATP")
         self._sorted_names.remove("Glycolysis")
         print(" * Variables being perturbed:", self._sorted_names)
+
+        # Semantics of the clamps ("before_inference" or "after_update", see
+        # perturbation_model.PERTURBATION_MODELS)
+        self._perturbation_model = Perturbation_Model(self.FS, self._sorted_names, perturbation_model)
+
+        # Glucose schedule
+        self._time_function = time_function
+
+        # Set inference engine
+        self.set_engine(engine, **options)
+        self._batch = None
         
     def _reset_variables(self):
         self.FS.set_variable("Glucose", 1.0)
@@ -498,48 +517,29 @@ class Model_Simulator(object):
         self.FS.set_variable("RasGTP", 1.0)
 
 
-    def simulate(self, perturbation=None):
-        # Simulate the model with a perturbation
-        self._reset_variables()
-
-        # dynamics = defaultdict(list)
-        # Off-set bug correction
-        dynamics = deepcopy(self.FS._variables)
-        for var in dynamics.keys():
-            dynamics[var] = [dynamics[var]]
-
-        for T in linspace(0, 1, self._max_steps):
-            self.FS.set_variable("Glucose", time_function(T))
-            
-            for k,v in zip(self._sorted_names, perturbation):
-                if v==1: #low
-                    self.FS.set_variable(k, 0.0)                    
-                elif v==2: #high
-                    self.FS.set_variable(k, 1.0)
-
-            new_values = self.FS.Sugeno_inference()
-
-            self.FS._variables.update(new_values)
-
-            for var in new_values.keys():          
-                dynamics[var].append(new_values[var])
-
-        return dynamics
-
     def fitness(self, x, SIM=None):
         # Calculate fitness of the perturbation
-        result = self.simulate(perturbation=x)
+        result = self.simulate(perturbation=x, record=(["Apoptosis", "Necrosis", "Survival"], [0, self._readout]))
         begin_apo = result['Apoptosis'][0]
-        end_apo = result['Apoptosis'][14] # t>0.13
+        end_apo = result['Apoptosis'][self._readout] # t>0.13
         begin_nec = result['Necrosis'][0]
-        end_nec = result['Necrosis'][14] # t>0.13
+        end_nec = result['Necrosis'][self._readout] # t>0.13
         begin_sur = result['Survival'][0]
-        end_sur = result['Survival'][14] # t>0.13
+        end_sur = result['Survival'][self._readout] # t>0.13
         complexity = len(list(filter(lambda y: y>0, x)))
         print(x, "%.3f, %.3f, %d" % (end_apo-begin_apo, end_nec-begin_nec, complexity))
         # return end_apo-begin_apo, end_nec-begin_nec, end_sur-begin_sur, complexity
         return -(end_apo-begin_apo), end_nec-begin_nec, end_sur-begin_sur, complexity
 
+    def fitness_batch(self, perturbations):
+        # Fitness of many perturbations at once, simulated with simulate_batch()
+        values = self.simulate_batch(perturbations, (["Apoptosis", "Necrosis", "Survival"], [0, self._readout]))
+        fitness = []
+        for x, v in zip(perturbations, values.tolist()):
+            complexity = len(list(filter(lambda y: y>0, x)))
+            fitness.append((-(v[1][0]-v[0][0]), v[1][1]-v[0][1], v[1][2]-v[0][2], complexity))
+        return fitness
+
 def time_function(curtime):
     if curtime<0.075: 
         return 1
@@ -561,6 +561,16 @@ if __name__ == '__main__':
 
     n_reps = 30
 
+    # Surrogate pre-screening of the offspring (see optimization_tools.Surrogate_Evaluator)
+    SURROGATE = False
+    # Multi-fidelity evaluation: offspring are screened with a coarser model (50 steps),
+    # only the promising ones are simulated with SIM (see optimization_tools.Multi_Fidelity_Evaluator)
+    MULTI_FIDELITY = False
+    # Stop when the hypervolume stagnates instead of after FEs (see optimization_tools.Hypervolume_Stagnation)
+    STAGNATION = False
+    # Evaluate the identical offspring of a generation once (see optimization_tools.Dedup_Evaluator)
+    DEDUP = False
+
     print(" * %d variables, %d objectives" % (D,OBJS))
     print(" * %d individuals, %d MAX_FEs, %d iterations, %d repetitions" % (POPSIZE, FEs, FEs//POPSIZE, n_reps)) 
     problem = Problem(D, OBJS)
@@ -574,10 +584,30 @@ if __name__ == '__main__':
                 (NSGAIII, {"population_size":POPSIZE, "divisions_outer":12}),
                 (SPEA2, {"population_size":POPSIZE})
                 ]
+    if SURROGATE or MULTI_FIDELITY or DEDUP:
+        # Each run (in its own process) gets its own evaluators and logs the simulations saved
+        COARSE = Model_Simulator(steps=50)
+        for _, kwargs in algorithms:
+            run_evaluator = MapEvaluator()
+            if SURROGATE:
+                run_evaluator = Surrogate_Evaluator(run_evaluator, retrain_interval=POPSIZE, exploration=0.1, verbose=True)
+            if MULTI_FIDELITY:
+                run_evaluator = Multi_Fidelity_Evaluator(run_evaluator, COARSE.fitness_batch, verbose=True)
+            if DEDUP:
+                run_evaluator = Dedup_Evaluator(run_evaluator, verbose=True)
+            kwargs["evaluator"] = run_evaluator
+
+    termination = FEs
+    if STAGNATION:
+        # Each run logs the FEs it consumed
+        termination = Hypervolume_Stagnation(FEs, Hypervolume(minimum=[-1.0, -1.0, -1.0, 0], maximum=[1.0, 1.0, 1.0, 16]))
+    if SURROGATE or MULTI_FIDELITY:
+        # The solutions of the results with estimated objectives are simulated at the end of each run
+        termination = Final_Simulation(termination)
 
     # Multi-processing (4 parallel processes)
     with ProcessPoolEvaluator(4) as evaluator:
-        results = experiment(algorithms, problem, nfe=FEs, seeds=n_reps , evaluator=evaluator, display_stats=True)
+        results = experiment(algorithms, problem, nfe=termination, seeds=n_reps , evaluator=evaluator, display_stats=True)
 
         # As of Platypus v1.0.4, NSGA-III works only with minimization objectives
         # Converting first objective (Apoptosis) back to positive
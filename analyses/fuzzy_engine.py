@@ -0,0 +1,773 @@
+#########################################################################################################
+# Compiled inference engine for the Sugeno-type dynamic fuzzy models defined with Simpful.
+# The FuzzySystem is parsed once into flat lists of variables, fuzzy sets (terms) and rules,
+# so that each inference step runs without linguistic variable lookups or string evaluation.
+# The arithmetic follows FS.Sugeno_inference() operation by operation, so that the results
+# are identical to Simpful's (see compare_engines).
+# Generated_Model goes one step further and generates a specialized Python module per model.
+#########################################################################################################
+
+from collections import defaultdict, OrderedDict
+from copy import copy
+from hashlib import sha1
+from importlib.util import spec_from_file_location, module_from_spec
+from os import getpid, makedirs, path, replace
+from simpful import LinguisticVariable
+from simpful.rule_parsing import Clause, Functional
+
+
+# Binary operators whose operands can be swapped
+COMMUTATIVE = ("AND", "OR", "AND_p", "OR_p")
+
+# Specialized models kept by Compiled_Model.specialize()
+MAX_SPECIALIZED = 1024
+
+
+class Compiled_Model(object):
+
+    def __init__(self, FS, sparse=True, cse=True, reduce=False, specialize=False, incremental=None, dirty_fraction=0.5,
+            lookup=None, resolution=1000, memo=None):
+        # Variables, in the order in which they were added to the FuzzySystem
+        self.variables = list(FS._lvs)
+        self._var_index = {var: i for i, var in enumerate(self.variables)}
+
+        # Fuzzy sets of all variables, flattened: term t belongs to variable
+        # self._term_var[t] and is a piecewise linear function of its segments
+        self.terms = []
+        self._term_var = []
+        self._segments = []
+        self._boundaries = []
+        self._var_terms = []
+        self._term_index = {}
+        for v, var in enumerate(self.variables):
+            ids = []
+            for fs in FS._lvs[var]._FSlist:
+                self._term_index[(var, fs._term)] = len(self.terms)
+                ids.append(len(self.terms))
+                self.terms.append((var, fs._term))
+                self._term_var.append(v)
+                x, y = fs._points.T[0].tolist(), fs._points.T[1].tolist()
+                self._segments.append(list(zip(x[:-1], y[:-1], x[1:], y[1:])))
+                self._boundaries.append((float(fs.boundary_values[0]), float(fs.boundary_values[1])))
+            self._var_terms.append(ids)
+
+        # With lookup="interpolate" or "nearest", values in [0, 1] are fuzzified
+        # from tables of the memberships on a uniform grid of the given
+        # resolution, instead of searching the segments (see error_bound)
+        if lookup not in (None, "interpolate", "nearest"):
+            raise Exception("ERROR: unknown lookup mode '%s', use 'interpolate' or 'nearest'" % lookup)
+        self.lookup = lookup
+        self.resolution = resolution
+        if lookup is not None:
+            # The last value is repeated, so that value=1 interpolates without a branch
+            self._tables = [[self.membership(t, i/resolution) for i in range(resolution+1)] for t in range(len(self.terms))]
+            for table in self._tables:
+                table.append(table[-1])
+
+        # memo: size (per variable) of a Fuzzification_Memo of the membership
+        # degrees of exact crisp values, or a Fuzzification_Memo
+        self.memo = Fuzzification_Memo(memo) if isinstance(memo, int) else memo
+
+        # Rules: antecedent (root node of the expression DAG), output variable,
+        # crisp output value, weight and multiplicity. With cse=True identical
+        # subexpressions (e.g., "(PKA IS Low) AND (ATP IS Low)") are a single
+        # node of the DAG, computed once per step and shared by all the rules
+        # that contain them
+        self.cse = cse
+        self._nodes = []
+        self._node_ids = {}
+        self.rules = []
+        for antecedent, consequent in FS._rules:
+            weight = float(consequent[2]) if len(consequent)>2 else 1.0
+            self.rules.append((self._parse(antecedent), self._var_index[consequent[0]],
+                FS._crispvalues[consequent[1]], weight, 1))
+
+        # With reduce=True the engine runs the reduced rule base (see
+        # rule_analysis.py): rules with the same antecedent and output are
+        # merged into one, and terms that no rule mentions are not fuzzified
+        self.reduce = reduce
+        if reduce:
+            self.rules = self._merge_rules()
+
+        # With specialize=True, Model_Simulator runs each perturbation on a copy
+        # of the model with the clamped variables folded in (see specialize)
+        self.sparse = sparse
+        self.specialized = specialize
+        self.clamps = {}
+        self._specializations = OrderedDict()
+
+        # With incremental=tolerance, each step recomputes only the outputs with
+        # a rule mentioning a variable that changed by more than the tolerance
+        # since it was last used (0.0: any change), and reuses the previous
+        # values of the others. When more than dirty_fraction of the inputs
+        # changed, the step is fully evaluated
+        self.incremental = incremental
+        self.dirty_fraction = dirty_fraction
+        self._build()
+
+    def _build(self):
+        # Operators in the rule trees, and in the DAG after elimination; only the
+        # operators with more than one parent need to be memoized in a step
+        self._rule_operators = [self._operators(rule[0]) for rule in self.rules]
+        self.tree_operators = sum(self._rule_operators)
+        reachable = self._reachable()
+        self.dag_operators = len([n for n in reachable if self._nodes[n][0] not in ("IS", "CONST")])
+        parents = defaultdict(int)
+        for n in reachable:
+            if self._nodes[n][0] not in ("IS", "CONST"):
+                for child in self._nodes[n][1:]:
+                    parents[child] += 1
+        for rule in self.rules:
+            parents[rule[0]] += 1
+        self._shared = set(n for n, node in enumerate(self._nodes) if node[0] not in ("IS", "CONST") and parents[n]>1)
+        self._referenced = self.referenced_terms()
+
+        # Variables that are inferred (i.e., appear in a consequent)
+        self.outputs = sorted(set(self.variables[rule[1]] for rule in self.rules))
+        self._output_rules = defaultdict(list)
+        for r, rule in enumerate(self.rules):
+            self._output_rules[rule[1]].append(r)
+
+        # Sparse firing index: (variable, term) -> rules that mention it. A rule
+        # made only of conjunctions fires only if all of its terms are active
+        # (membership > 0), i.e., if the number of its distinct terms that are
+        # active reaches _rule_arity; rules with OR/NOT are always evaluated
+        self._rule_terms = [self._leaves(rule[0]) for rule in self.rules]
+        self._rule_arity = [len(set(terms)) for terms in self._rule_terms]
+        self._term_rules = defaultdict(list)
+        self._dense_rules = []
+        for r, rule in enumerate(self.rules):
+            if self._conjunctive(rule[0]) and self._rule_terms[r]:
+                for t in set(self._rule_terms[r]):
+                    self._term_rules[t].append(r)
+            else:
+                self._dense_rules.append(r)
+
+        # Dependencies for the incremental evaluation: input variable -> outputs
+        # with a rule that mentions it, output -> terms mentioned by its rules
+        self._inputs = sorted(set(self._term_var[t] for t in self._referenced))
+        self._dependents = defaultdict(set)
+        self._output_terms = defaultdict(set)
+        for r, rule in enumerate(self.rules):
+            for t in self._rule_terms[r]:
+                self._dependents[self._term_var[t]].add(rule[1])
+                self._output_terms[rule[1]].add(t)
+        self.reset_state()
+        self.reset_counters()
+
+    def _parse(self, node):
+        # Convert Simpful's antecedent (Clause/Functional objects) into nodes of
+        # the expression DAG, returning the index of the root
+        if isinstance(node, Clause):
+            return self._add_node(("IS", self._term_index[(node._variable, node._term)]))
+        if isinstance(node, Functional):
+            if node._fun=="NOT":
+                return self._add_node(("NOT", self._parse(node._B)))
+            a, b = self._parse(node._A), self._parse(node._B)
+            if node._fun in COMMUTATIVE and b<a:
+                a, b = b, a
+            return self._add_node((node._fun, a, b))
+        raise Exception("ERROR: cannot compile antecedent %s" % str(node))
+
+    def _add_node(self, node):
+        # Hash-consing of the nodes: identical subexpressions get the same index
+        if self.cse and node in self._node_ids:
+            return self._node_ids[node]
+        self._node_ids[node] = len(self._nodes)
+        self._nodes.append(node)
+        return len(self._nodes)-1
+
+    def _leaves(self, n):
+        node = self._nodes[n]
+        if node[0]=="IS":
+            return [node[1]]
+        if node[0]=="CONST":
+            return []
+        return [t for child in node[1:] for t in self._leaves(child)]
+
+    def _operators(self, n):
+        node = self._nodes[n]
+        if node[0] in ("IS", "CONST"):
+            return 0
+        return 1 + sum(self._operators(child) for child in node[1:])
+
+    def _conjunctive(self, n):
+        node = self._nodes[n]
+        return node[0] in ("IS", "CONST") or (node[0] in ("AND", "AND_p") and all(self._conjunctive(child) for child in node[1:]))
+
+    def _key(self, n):
+        # Structural key of node n, independent of the sharing of nodes
+        node = self._nodes[n]
+        if node[0] in ("IS", "CONST"):
+            return node
+        children = [self._key(child) for child in node[1:]]
+        if node[0] in COMMUTATIVE:
+            children.sort()
+        return (node[0],) + tuple(children)
+
+    def rule_groups(self):
+        # Indices of the rules with the same antecedent and output variable
+        groups = defaultdict(list)
+        for r, rule in enumerate(self.rules):
+            groups[(self._key(rule[0]), rule[1])].append(r)
+        return list(groups.values())
+
+    def _merge_rules(self):
+        # Each group of rules with the same antecedent A and output contributes
+        # A*sum(crisp*weight) to the numerator and A*len(group) to the
+        # denominator of the Sugeno weighted average: replace it with one rule
+        merged = []
+        for group in self.rule_groups():
+            rules = [self.rules[r] for r in group]
+            merged.append((rules[0][0], rules[0][1], sum(rule[2]*rule[3]*rule[4] for rule in rules), 1.0,
+                sum(rule[4] for rule in rules)))
+        return merged
+
+    def _reachable(self):
+        # Nodes of the DAG used by the rules
+        reachable = set()
+        pending = [rule[0] for rule in self.rules]
+        while pending:
+            n = pending.pop()
+            if n not in reachable:
+                reachable.add(n)
+                if self._nodes[n][0] not in ("IS", "CONST"):
+                    pending.extend(self._nodes[n][1:])
+        return reachable
+
+    def referenced_terms(self):
+        # Terms that appear in at least one antecedent
+        return sorted(set(t for rule in self.rules for t in self._leaves(rule[0])))
+
+    def specialize(self, clamps, infer_clamped=False):
+        # Partial evaluation of the model for a perturbation, i.e., a dictionary
+        # {variable: value} of the variables clamped before each inference: the
+        # memberships of the clamped variables become constants ("CONST" nodes)
+        # and are folded into the antecedents, rules that can never fire are
+        # dropped, and so are the rules of the clamped variables, which keep
+        # their clamped value (with infer_clamped=True they are kept, and the
+        # clamped variables are inferred as in the full model; see
+        # perturbation_model.PERTURBATION_MODELS). Folding only uses identities
+        # that are exact in [0, 1] (e.g., x AND 1 = x, x OR 0 = x), so that the
+        # results do not change. The specialized models are cached (up to
+        # MAX_SPECIALIZED)
+        key = (tuple(sorted(clamps.items())), infer_clamped)
+        if key in self._specializations:
+            self._specializations.move_to_end(key)
+            return self._specializations[key]
+
+        model = copy(self)
+        model.clamps = dict(clamps)
+        model._specializations = OrderedDict()
+        model._nodes = []
+        model._node_ids = {}
+        constants = {t: self.membership(t, clamps[var]) for t, (var, term) in enumerate(self.terms) if var in clamps}
+        folded = {}
+        model.rules = []
+        for antecedent, output, crisp, weight, multiplicity in self.rules:
+            if self.variables[output] in clamps and not infer_clamped:
+                continue
+            root = model._fold(self._nodes, antecedent, constants, folded)
+            if model._nodes[root]!=("CONST", 0.0):
+                model.rules.append((root, output, crisp, weight, multiplicity))
+        model._build()
+        model.outputs = [var for var in self.outputs if infer_clamped or var not in clamps]
+
+        self._specializations[key] = model
+        if len(self._specializations)>MAX_SPECIALIZED:
+            self._specializations.popitem(last=False)
+        return model
+
+    def _fold(self, nodes, n, constants, folded):
+        # Copy node n of the DAG `nodes` into this model, folding the constants
+        if n in folded:
+            return folded[n]
+        node = nodes[n]
+        op = node[0]
+        if op=="IS":
+            if node[1] in constants:
+                result = self._add_node(("CONST", constants[node[1]]))
+            else:
+                result = self._add_node(node)
+        elif op=="CONST":
+            result = self._add_node(node)
+        else:
+            children = [self._fold(nodes, child, constants, folded) for child in node[1:]]
+            values = [self._nodes[child][1] if self._nodes[child][0]=="CONST" else None for child in children]
+            if op=="NOT":
+                result = self._add_node(("CONST", 1.-values[0]) if values[0] is not None else ("NOT", children[0]))
+            elif values[0] is not None and values[1] is not None:
+                a, b = values
+                value = {"AND": min(a, b), "OR": max(a, b), "AND_p": a*b}.get(op, a+b-a*b)
+                result = self._add_node(("CONST", value))
+            else:
+                result = None
+                for c, other in ((0, 1), (1, 0)):
+                    if values[c] is None:
+                        continue
+                    if (op, values[c]) in (("AND", 1.0), ("OR", 0.0), ("AND_p", 1.0), ("OR_p", 0.0)):
+                        result = children[other]
+                    elif (op, values[c]) in (("AND", 0.0), ("AND_p", 0.0)):
+                        result = self._add_node(("CONST", 0.0))
+                    elif (op, values[c])==("OR", 1.0):
+                        result = self._add_node(("CONST", 1.0))
+                if result is None:
+                    a, b = children
+                    if op in COMMUTATIVE and b<a:
+                        a, b = b, a
+                    result = self._add_node((op, a, b))
+        folded[n] = result
+        return result
+
+    def reset_state(self):
+        # Forget the inputs and outputs of the last step of the incremental
+        # evaluation, so that the next step is fully evaluated; done at the
+        # start of every simulation (see Simulation_Mixin.stream), so that a
+        # simulation never depends on the one that ran before it
+        self._last_inputs = None
+        self._last_outputs = None
+
+    def reset_counters(self):
+        # Number of rule evaluations performed and skipped by the sparse index,
+        # and of operator (AND/OR/NOT) evaluations performed and eliminated by
+        # the sharing of common subexpressions
+        self.rule_evaluations = 0
+        self.skipped_rules = 0
+        self.operator_evaluations = 0
+        self.eliminated_operators = 0
+        # Incremental evaluation: steps fully evaluated, outputs recomputed and
+        # outputs reused from the previous step
+        self.full_evaluations = 0
+        self.recomputed_outputs = 0
+        self.reused_outputs = 0
+
+    def membership(self, t, value):
+        # Same interpolation as FuzzySet.get_value_fast
+        segments = self._segments[t]
+        if value<segments[0][0]:
+            return self._boundaries[t][0]
+        for x0, y0, x1, y1 in segments:
+            if x0<=value<=x1:
+                return y0 + (value-x0) * ((y1-y0)/(x1-x0))
+        return self._boundaries[t][1]
+
+    def table_membership(self, t, value):
+        # Membership from the lookup table; values outside [0, 1] are computed exactly
+        if not 0.0<=value<=1.0:
+            return self.membership(t, value)
+        position = value*self.resolution
+        if self.lookup=="nearest":
+            return self._tables[t][int(position+0.5)]
+        i = int(position)
+        table = self._tables[t]
+        return table[i] + (position-i)*(table[i+1]-table[i])
+
+    def error_bound(self):
+        # Largest error of the lookup tables over [0, 1], up to rounding. A
+        # piecewise linear membership is interpolated exactly on the grid
+        # intervals without breakpoints; in an interval of width h containing a
+        # breakpoint where the slope changes by d, the error is at most d*h/4
+        # (plus the size of the jump, for discontinuous sets). With nearest
+        # neighbour lookup the error is at most |slope|*h/2 (plus jumps)
+        if self.lookup is None:
+            return 0.0
+        h = 1./self.resolution
+        bound = 0.0
+        for t, segments in enumerate(self._segments):
+            # Pieces of the membership over [0, 1]: (x0, x1, value at x0, value at x1, slope)
+            low, high = self._boundaries[t]
+            pieces = [(0.0, segments[0][0], low, low, 0.0)]
+            pieces += [(x0, x1, y0, y1, (y1-y0)/(x1-x0) if x1>x0 else 0.0) for x0, y0, x1, y1 in segments]
+            pieces.append((segments[-1][2], 1.0, high, high, 0.0))
+            pieces = [piece for piece in pieces if piece[1]>=0.0 and piece[0]<=1.0]
+            if self.lookup=="nearest":
+                error = max(abs(piece[4]) for piece in pieces)*h/2
+            else:
+                error = 0.0
+                for left, right in zip(pieces, pieces[1:]):
+                    on_grid = abs(right[0]*self.resolution-round(right[0]*self.resolution))<1e-9
+                    if not on_grid:
+                        error = max(error, abs(right[4]-left[4])*h/4)
+            jumps = [abs(right[2]-left[3]) for left, right in zip(pieces, pieces[1:])]
+            bound = max(bound, error+max(jumps+[0.0]))
+        return bound
+
+    def lookup_error(self, samples=100000):
+        # Largest error of the lookup tables measured on a uniform sample of
+        # [0, 1] and on the breakpoints of the fuzzy sets, to be compared with
+        # error_bound()
+        values = [i/(samples-1.) for i in range(samples)]
+        values += [x for segments in self._segments for segment in segments for x in (segment[0], segment[2]) if 0<=x<=1]
+        return max(abs(self.table_membership(t, value)-self.membership(t, value))
+            for t in range(len(self.terms)) for value in values)
+
+    def fuzzify(self, state):
+        # Membership degrees of all terms for a state (list in self.variables order);
+        # with reduce=True (or in a specialized model) the terms that no rule
+        # mentions are left at 0
+        membership = self.membership if self.lookup is None else self.table_membership
+        if self.memo is not None:
+            mu = [0.0]*len(self.terms)
+            for v in self._inputs:
+                value = state[v]
+                degrees = self.memo.get(self.variables[v], value)
+                if degrees is None:
+                    degrees = [membership(t, value) for t in self._var_terms[v]]
+                    self.memo.put(self.variables[v], value, degrees)
+                for t, m in zip(self._var_terms[v], degrees):
+                    mu[t] = m
+            return mu
+        if self.reduce or self.clamps:
+            mu = [0.0]*len(self.terms)
+            for t in self._referenced:
+                mu[t] = membership(t, state[self._term_var[t]])
+            return mu
+        return [membership(t, state[self._term_var[t]]) for t in range(len(self.terms))]
+
+    def evaluate(self, n, mu, values):
+        # Firing strength of node n; shared nodes are memoized in `values`
+        node = self._nodes[n]
+        op = node[0]
+        if op=="IS":
+            return mu[node[1]]
+        if op=="CONST":
+            return node[1]
+        if n in values:
+            return values[n]
+        self.operator_evaluations += 1
+        if op=="NOT":
+            value = 1.-self.evaluate(node[1], mu, values)
+        else:
+            a, b = self.evaluate(node[1], mu, values), self.evaluate(node[2], mu, values)
+            if op=="AND":
+                value = min(a, b)
+            elif op=="OR":
+                value = max(a, b)
+            elif op=="AND_p":
+                value = a*b
+            else: # OR_p
+                value = a+b-a*b
+        if n in self._shared:
+            values[n] = value
+        return value
+
+    def firing_rules(self, mu):
+        # Indices (in rule order) of the rules with nonzero firing strength
+        if not self.sparse:
+            return range(len(self.rules))
+        counts = defaultdict(int)
+        for t, m in enumerate(mu):
+            if m>0:
+                for r in self._term_rules[t]:
+                    counts[r] += 1
+        firing = [r for r, c in counts.items() if c==self._rule_arity[r]]
+        firing.extend(self._dense_rules)
+        firing.sort()
+        return firing
+
+    def infer(self, state):
+        # One Sugeno inference step: new values of self.outputs
+        if self.incremental is not None:
+            return self._infer_incremental(state)
+        return self.infer_full(state)
+
+    def _infer_incremental(self, state):
+        # Dirty tracking: the inputs are compared with the values they had when
+        # they were last used, so that slow drifts are eventually caught
+        changed = [] if self._last_inputs is None else [v for v in self._inputs
+            if abs(state[v]-self._last_inputs[v])>self.incremental]
+        if self._last_inputs is None or len(changed)>self.dirty_fraction*len(self._inputs):
+            self._last_inputs = list(state)
+            self._last_outputs = dict(zip(map(self._var_index.get, self.outputs), self.infer_full(state)))
+            self.full_evaluations += 1
+            return list(self._last_outputs.values())
+
+        dirty = set()
+        for v in changed:
+            self._last_inputs[v] = state[v]
+            dirty.update(self._dependents[v])
+        if dirty:
+            membership = self.membership if self.lookup is None else self.table_membership
+            mu = [0.0]*len(self.terms)
+            for t in set().union(*(self._output_terms[o] for o in dirty)):
+                mu[t] = membership(t, state[self._term_var[t]])
+            num, den = self._sums(mu, [r for r in self.firing_rules(mu) if self.rules[r][1] in dirty])
+            for o in dirty:
+                self._last_outputs[o] = num[o]/den[o] if den[o]!=0.0 else 0.0
+        self.recomputed_outputs += len(dirty)
+        self.reused_outputs += len(self._last_outputs)-len(dirty)
+        return list(self._last_outputs.values())
+
+    def infer_full(self, state):
+        # Inference step without incremental evaluation
+        mu = self.fuzzify(state)
+        num, den = self._sums(mu, self.firing_rules(mu))
+        return [num[v]/den[v] if den[v]!=0.0 else 0.0 for v in map(self._var_index.get, self.outputs)]
+
+    def _sums(self, mu, firing):
+        # Numerators and denominators of the weighted averages, over the rules in `firing`
+        self.rule_evaluations += len(firing)
+        self.skipped_rules += len(self.rules)-len(firing)
+
+        evaluated = self.operator_evaluations
+        num = defaultdict(float)
+        den = defaultdict(float)
+        values = {}
+        for r in firing:
+            antecedent, output, crisp, weight, multiplicity = self.rules[r]
+            value = self.evaluate(antecedent, mu, values)
+            num[output] += value*crisp*weight
+            den[output] += value*multiplicity
+        self.eliminated_operators += sum(self._rule_operators[r] for r in firing) - (self.operator_evaluations-evaluated)
+        return num, den
+
+    def Sugeno_inference(self, variables):
+        # Drop-in replacement of FS.Sugeno_inference() for the state in `variables`
+        state = [variables[var] for var in self.variables]
+        return dict(zip(self.outputs, self.infer(state)))
+
+
+class Fuzzification_Memo(object):
+
+    def __init__(self, max_size=64):
+        # Membership degrees of the terms of each variable for exact crisp values
+        # that recur (e.g., clamped 0/1, initial states, Glucose outside of the
+        # transition), keeping the max_size most recently used values per variable
+        self.max_size = max_size
+        self._memo = defaultdict(OrderedDict)
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.variable_hits = defaultdict(int)
+        self.variable_misses = defaultdict(int)
+
+    def get(self, var, value):
+        # Memoized degrees of var at value, or None
+        memo = self._memo[var]
+        degrees = memo.get(value)
+        if degrees is None:
+            self.misses += 1
+            self.variable_misses[var] += 1
+        else:
+            self.hits += 1
+            self.variable_hits[var] += 1
+            memo.move_to_end(value)
+        return degrees
+
+    def put(self, var, value, degrees):
+        memo = self._memo[var]
+        memo[value] = degrees
+        if len(memo)>self.max_size:
+            memo.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        return self.hits/float(self.hits+self.misses) if self.hits+self.misses>0 else 0.0
+
+    def report(self):
+        print(" * Fuzzification memo: %d hits, %d misses (hit rate %.1f%%), %d evictions" % (self.hits, self.misses, 100*self.hit_rate(), self.evictions))
+        for var in sorted(set(self.variable_hits)|set(self.variable_misses)):
+            print("   %s: %d hits, %d misses" % (var, self.variable_hits[var], self.variable_misses[var]))
+
+    def install(self, FS):
+        # Memoize the fuzzification of Simpful's own inference: the
+        # get_values() of every linguistic variable of FS goes through the memo
+        for var, lv in FS._lvs.items():
+            lv.get_values = _Memoized_Values(self, var, lv)
+
+    def uninstall(self, FS):
+        for lv in FS._lvs.values():
+            if isinstance(lv.__dict__.get("get_values"), _Memoized_Values):
+                del lv.get_values
+
+
+class _Memoized_Values(object):
+    # LinguisticVariable.get_values() through a Fuzzification_Memo (a class
+    # rather than a closure, so that the FuzzySystem can still be pickled)
+
+    def __init__(self, memo, var, lv):
+        self.memo = memo
+        self.var = var
+        self.lv = lv
+
+    def __call__(self, value):
+        degrees = self.memo.get(self.var, value)
+        if degrees is None:
+            degrees = LinguisticVariable.get_values(self.lv, value)
+            self.memo.put(self.var, value, degrees)
+        return degrees
+
+
+class Generated_Model(object):
+
+    def __init__(self, FS, reduce=True, cache_dir=None):
+        # Straight-line Python code generated from the compiled model: every
+        # membership function is inlined as comparisons and arithmetic on
+        # constants, every operator of the DAG is a local variable, and the
+        # weighted average of each output is unrolled over its rules. The module
+        # is written to cache_dir under the hash of its source, and imported
+        # from there by later instances (and by the worker processes)
+        model = Compiled_Model(FS, sparse=False, cse=True, reduce=reduce)
+        self.variables = model.variables
+        self.outputs = model.outputs
+        self.source = generate_source(model)
+        self.model_hash = sha1(self.source.encode("utf-8")).hexdigest()
+        if cache_dir is None:
+            cache_dir = path.join(path.dirname(path.abspath(__file__)), "__modelcache__")
+        self.cache_dir = cache_dir
+        self._load()
+
+    def _load(self):
+        filename = path.join(self.cache_dir, "model_%s.py" % self.model_hash)
+        if not path.exists(filename):
+            makedirs(self.cache_dir, exist_ok=True)
+            temporary = "%s.%d" % (filename, getpid())
+            with open(temporary, "w") as fo:
+                fo.write(self.source)
+            replace(temporary, filename)
+        spec = spec_from_file_location("model_%s" % self.model_hash, filename)
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.infer = module.infer
+        self.Sugeno_inference = module.Sugeno_inference
+
+    def __getstate__(self):
+        # Functions of the generated module are not picklable: they are
+        # imported again from the cache when unpickled
+        state = self.__dict__.copy()
+        del state["infer"], state["Sugeno_inference"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load()
+
+
+def _float(value):
+    # Literal of a float that is read back as the same double
+    return repr(float(value))
+
+
+def generate_source(model):
+    # Source of the module of a Generated_Model. It defines infer(state), where
+    # state is a list in model.variables order, and Sugeno_inference(variables),
+    # taking the dictionary FS._variables; both compute the same expressions as
+    # Compiled_Model.infer(), in the same order
+    body = []
+
+    # Memberships of the referenced terms (same interpolation as get_value_fast)
+    for t in model.referenced_terms():
+        segments = [segment for segment in model._segments[t] if segment[2]>segment[0]]
+        low, high = model._boundaries[t]
+        body.append("if x%d<%s: m%d = %s" % (model._term_var[t], _float(segments[0][0]), t, _float(low)))
+        for x0, y0, x1, y1 in segments:
+            slope = (y1-y0)/(x1-x0)
+            if slope==0:
+                value = _float(y0)
+            else:
+                value = "%s + (x%d-%s) * %s" % (_float(y0), model._term_var[t], _float(x0), _float(slope))
+            body.append("elif x%d<=%s: m%d = %s" % (model._term_var[t], _float(x1), t, value))
+        body.append("else: m%d = %s" % (t, _float(high)))
+
+    # Operators of the DAG, in topological order (children have lower indices)
+    def name(n):
+        node = model._nodes[n]
+        return "m%d" % node[1] if node[0]=="IS" else "n%d" % n
+    for n in sorted(model._reachable()):
+        node = model._nodes[n]
+        if node[0]=="IS":
+            continue
+        if node[0]=="NOT":
+            body.append("n%d = 1.-%s" % (n, name(node[1])))
+            continue
+        a, b = name(node[1]), name(node[2])
+        if node[0]=="AND":
+            body.append("n%d = %s if %s<%s else %s" % (n, b, b, a, a))
+        elif node[0]=="OR":
+            body.append("n%d = %s if %s>%s else %s" % (n, b, b, a, a))
+        elif node[0]=="AND_p":
+            body.append("n%d = %s*%s" % (n, a, b))
+        else:
+            body.append("n%d = %s+%s-%s*%s" % (n, a, b, a, b))
+
+    # Unrolled weighted averages; terms with a null crisp value do not
+    # contribute to the numerator
+    results = []
+    for var in model.outputs:
+        v = model._var_index[var]
+        num, den = [], []
+        for r in model._output_rules[v]:
+            antecedent, output, crisp, weight, multiplicity = model.rules[r]
+            if crisp*weight==0:
+                continue
+            elif weight!=1:
+                num.append("%s*%s*%s" % (name(antecedent), _float(crisp), _float(weight)))
+            else:
+                num.append(name(antecedent) if crisp==1 else "%s*%s" % (name(antecedent), _float(crisp)))
+        for r in model._output_rules[v]:
+            antecedent, multiplicity = model.rules[r][0], model.rules[r][4]
+            den.append(name(antecedent) if multiplicity==1 else "%s*%s" % (name(antecedent), _float(multiplicity)))
+        body.append("den = %s" % " + ".join(den))
+        body.append("o%d = (%s)/den if den!=0.0 else 0.0" % (v, " + ".join(num) if num else "0.0"))
+        results.append("o%d" % v)
+
+    used = sorted(set(model._term_var[t] for t in model.referenced_terms()))
+    lines = ["# Generated from a Simpful FuzzySystem by fuzzy_engine.Generated_Model, do not edit", "",
+        "def infer(state):"]
+    lines.extend("    x%d = state[%d]" % (v, v) for v in used)
+    lines.extend("    " + line for line in body)
+    lines.append("    return [%s]" % ", ".join(results))
+    lines.extend(["", "def Sugeno_inference(variables):"])
+    lines.extend("    x%d = variables[%r]" % (v, model.variables[v]) for v in used)
+    lines.extend("    " + line for line in body)
+    lines.append("    return {%s}" % ", ".join("%r: o%d" % (var, model._var_index[var]) for var in model.outputs))
+    return "\n".join(lines) + "\n"
+
+
+# Inference engines available to Model_Simulator.set_engine()
+ENGINES = {"compiled": Compiled_Model, "generated": Generated_Model}
+
+
+def make_engine(name, FS, **options):
+    if name not in ENGINES:
+        raise Exception("ERROR: unknown inference engine '%s', available engines: %s" % (name, ", ".join(ENGINES)))
+    return ENGINES[name](FS, **options)
+
+
+def order_independence(SIM, perturbations, engine="compiled", steps=None, **options):
+    # Check that the simulations with an engine do not depend on the ones that
+    # ran before them (e.g., through the state of the incremental evaluation):
+    # simulates the perturbations in order and in reverse order, and returns
+    # the largest absolute difference over all the states
+    reference = SIM._engine
+    try:
+        SIM.set_engine(engine, **options)
+        forward = [[state for _, state in SIM.stream(perturbation, steps=steps)] for perturbation in perturbations]
+        backward = [[state for _, state in SIM.stream(perturbation, steps=steps)] for perturbation in reversed(perturbations)]
+    finally:
+        SIM._engine = reference
+    worst = 0.0
+    for states, others in zip(forward, reversed(backward)):
+        for state, other in zip(states, others):
+            worst = max(worst, max(abs(state[var]-other[var]) for var in other))
+    return worst
+
+
+def compare_engines(SIM, perturbations, engine="compiled", steps=None, **options):
+    # Differential check of an engine against Simpful: simulates every perturbation
+    # with both and returns the largest absolute difference over all the states
+    reference = SIM._engine
+    worst = 0.0
+    try:
+        for perturbation in perturbations:
+            SIM.set_engine(None)
+            expected = [state for _, state in SIM.stream(perturbation, steps=steps)]
+            SIM.set_engine(engine, **options)
+            for (_, state), other in zip(SIM.stream(perturbation, steps=steps), expected):
+                worst = max(worst, max(abs(state[var]-other[var]) for var in other))
+    finally:
+        SIM._engine = reference
+    return worst
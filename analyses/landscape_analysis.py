@@ -0,0 +1,157 @@
+#########################################################################################################
+# Fitness landscape analysis over the perturbation graph (genotypes of ternary genes, edges
+# between genotypes that differ in one gene): neighbour-fitness correlation, fraction of local
+# optima per objective and random-walk autocorrelation. Fitness is evaluated in batches (e.g.,
+# through optimization_tools.Fitness_Cache, so that neighbourhoods are never simulated twice)
+# and only streaming statistics are kept, so the samples can be as many as needed.
+#########################################################################################################
+
+from numpy import arange, array, concatenate, errstate, inf, log, nan, sqrt, where, zeros
+from numpy.random import default_rng
+
+
+class Streaming_Correlation(object):
+
+    def __init__(self):
+        # Pearson correlation of pairs of objective vectors (one per column),
+        # updated in batches by merging their moments (Chan et al.)
+        self.n = 0
+        self.mean_x = self.mean_y = self.m2_x = self.m2_y = self.c_xy = 0.0
+
+    def update(self, x, y):
+        # x, y: arrays (samples, objectives)
+        n = len(x)
+        if n==0:
+            return
+        mean_x, mean_y = x.mean(axis=0), y.mean(axis=0)
+        dx, dy = mean_x-self.mean_x, mean_y-self.mean_y
+        total = self.n+n
+        self.m2_x = self.m2_x + ((x-mean_x)**2).sum(axis=0) + dx**2*self.n*n/total
+        self.m2_y = self.m2_y + ((y-mean_y)**2).sum(axis=0) + dy**2*self.n*n/total
+        self.c_xy = self.c_xy + ((x-mean_x)*(y-mean_y)).sum(axis=0) + dx*dy*self.n*n/total
+        self.mean_x = self.mean_x + dx*n/total
+        self.mean_y = self.mean_y + dy*n/total
+        self.n = total
+
+    def correlation(self):
+        # Constant objectives (zero variance) have correlation nan
+        with errstate(invalid="ignore", divide="ignore"):
+            return where(self.m2_x*self.m2_y>0, self.c_xy/sqrt(self.m2_x*self.m2_y), nan)
+
+
+def random_genotypes(rng, samples, genes, levels=3):
+    return rng.integers(0, levels, size=(samples, genes))
+
+
+def neighbourhoods(genotypes, levels=3):
+    # All the genotypes that differ in one gene: array (samples, genes*(levels-1), genes)
+    samples, genes = genotypes.shape
+    neighbours = genotypes[:, None, :].repeat(genes*(levels-1), axis=1)
+    moves = arange(genes*(levels-1))
+    gene, shift = moves//(levels-1), moves%(levels-1)+1
+    neighbours[:, moves, gene] = (genotypes[:, gene]+shift)%levels
+    return neighbours
+
+
+def random_neighbours(rng, genotypes, levels=3):
+    # One random genotype of the neighbourhood of each genotype
+    neighbours = genotypes.copy()
+    rows = arange(len(genotypes))
+    gene = rng.integers(0, genotypes.shape[1], size=len(genotypes))
+    neighbours[rows, gene] = (genotypes[rows, gene]+rng.integers(1, levels, size=len(genotypes)))%levels
+    return neighbours
+
+
+def neighbour_correlation(fitness_batch, genes, samples=100000, batch_size=10000, seed=None):
+    # Correlation between the objectives of random genotypes and of a random
+    # neighbour of each (1: smooth landscape, 0: uncorrelated). Returns an array
+    # with one correlation per objective
+    rng = default_rng(seed)
+    stats = Streaming_Correlation()
+    for start in range(0, samples, batch_size):
+        genotypes = random_genotypes(rng, min(batch_size, samples-start), genes)
+        values = fitness_batch(concatenate([genotypes, random_neighbours(rng, genotypes)]))
+        stats.update(values[:len(genotypes)], values[len(genotypes):])
+    return stats.correlation()
+
+
+def local_optima(fitness_batch, genes, signs, samples=10000, batch_size=1000, seed=None):
+    # Fraction of random genotypes that are local optima, i.e. no neighbour
+    # improves the objective (signs: +1 minimized, -1 maximized objectives), per
+    # objective and in the Pareto sense (no neighbour dominates the genotype);
+    # genotypes on plateaus count as local optima.
+    # The expected number of local optima is the fraction times 3**genes.
+    # Returns (fractions per objective, Pareto fraction)
+    rng = default_rng(seed)
+    signs = array(signs, dtype=float)
+    optima, pareto = zeros(len(signs)), 0
+    for start in range(0, samples, batch_size):
+        genotypes = random_genotypes(rng, min(batch_size, samples-start), genes)
+        neighbours = neighbourhoods(genotypes)
+        values = fitness_batch(concatenate([genotypes, neighbours.reshape(-1, genes)]))*signs
+        f, g = values[:len(genotypes)], values[len(genotypes):].reshape(len(genotypes), neighbours.shape[1], -1)
+        optima += (g>=f[:, None, :]).all(axis=1).sum(axis=0)
+        pareto += (~((g<=f[:, None, :]).all(axis=2) & (g<f[:, None, :]).any(axis=2)).any(axis=1)).sum()
+    return optima/samples, pareto/float(samples)
+
+
+def random_walk_autocorrelation(fitness_batch, genes, walks=1000, length=1000, max_lag=10, seed=None):
+    # Autocorrelation of the objectives along random walks on the perturbation
+    # graph, for lags 1..max_lag. The walks move in parallel (one batch per
+    # step) and only the last max_lag steps are kept. Returns (array
+    # (max_lag, objectives) of autocorrelations, correlation length -1/ln(rho(1)))
+    rng = default_rng(seed)
+    stats = [Streaming_Correlation() for _ in range(max_lag)]
+    genotypes = random_genotypes(rng, walks, genes)
+    history = [fitness_batch(genotypes)]
+    for step in range(1, length):
+        genotypes = random_neighbours(rng, genotypes)
+        values = fitness_batch(genotypes)
+        for lag in range(1, min(step, max_lag)+1):
+            stats[lag-1].update(values, history[-lag])
+        history = (history+[values])[-max_lag:]
+    rho = array([s.correlation() for s in stats])
+    with errstate(invalid="ignore", divide="ignore"):
+        length = where((rho[0]>0) & (rho[0]<1), -1./log(abs(rho[0])), where(rho[0]>=1, inf, 0.0))
+    return rho, length
+
+
+def landscape_analysis(fitness_batch, genes, signs, names=None, samples=100000, walks=1000, length=1000,
+        max_lag=10, seed=None, verbose=True):
+    # Run the three analyses; returns a dictionary with their results
+    report = {"neighbour_correlation": neighbour_correlation(fitness_batch, genes, samples, seed=seed)}
+    report["local_optima"], report["pareto_local_optima"] = local_optima(fitness_batch, genes, signs, samples//10, seed=seed)
+    report["autocorrelation"], report["correlation_length"] = random_walk_autocorrelation(fitness_batch, genes,
+        walks, length, max_lag, seed=seed)
+    if verbose:
+        if names is None:
+            names = ["objective %d" % j for j in range(len(signs))]
+        for j, name in enumerate(names):
+            print(" * %s: neighbour correlation %.3f, local optima %.3f%% (about %d), autocorrelation %s, correlation length %.2f" % (
+                name, report["neighbour_correlation"][j], 100*report["local_optima"][j], report["local_optima"][j]*3**genes,
+                " ".join("%.3f" % r for r in report["autocorrelation"][:, j]), report["correlation_length"][j]))
+        print(" * Pareto local optima: %.3f%% (about %d)" % (100*report["pareto_local_optima"], report["pareto_local_optima"]*3**genes))
+    return report
+
+
+if __name__ == '__main__':
+
+    from three_obj_optimization_programmed_cell_death_comparison import Model_Simulator
+    from optimization_tools import Fitness_Cache
+    from batch_engine import available_backends
+
+    SIM = Model_Simulator()
+    SIM.set_backend(available_backends()[0])
+    CACHE = Fitness_Cache(SIM)
+
+    SAMPLES = 100000
+    WALKS = 1000
+    LENGTH = 1000
+    MAX_LAG = 10
+
+    # Objectives of Model_Simulator.fitness (all minimized)
+    NAMES = ["Apoptosis", "Necrosis", "Complexity"]
+    landscape_analysis(CACHE, len(SIM._sorted_names), [1, 1, 1], NAMES, samples=SAMPLES, walks=WALKS, length=LENGTH,
+        max_lag=MAX_LAG, seed=0)
+    CACHE.report()
+    CACHE.save()
@@ -0,0 +1,769 @@
+#########################################################################################################
+# Tools for the multi-objective optimization of perturbations with Platypus: evaluators that
+# wrap the evaluator of the algorithm (e.g., ProcessPoolEvaluator) to reduce the number of
+# simulations of the dynamic fuzzy model (surrogate pre-screening, deduplication of the
+# genotypes of a generation, multi-fidelity evaluation), a Hamming-1 local search that refines
+# the results of an algorithm, a persistent cache of the fitness and an archive of the fronts
+# for warm starts, both keyed by the hash of the model, and a termination condition on the
+# stagnation of the hypervolume.
+#########################################################################################################
+
+from collections import OrderedDict, deque
+from copy import deepcopy
+from hashlib import sha1
+from inspect import getsource
+from os import getpid, makedirs, path, replace
+from random import Random
+from sys import modules
+from numpy import arange, argpartition, argsort, array, asarray, concatenate, corrcoef, inf, int64, load, savez, searchsorted, zeros
+from platypus import MaxEvaluations, Problem, Solution
+from platypus.core import EvaluateSolution, Generator, TerminationCondition
+from platypus.evaluator import Evaluator
+from fuzzy_engine import Compiled_Model, generate_source
+
+try:
+    from sklearn.ensemble import RandomForestRegressor
+except ImportError:
+    RandomForestRegressor = None
+
+
+def decode(solution):
+    # Genes of a Platypus solution (Integer variables are binary encoded)
+    return [t.decode(v) for t, v in zip(solution.problem.types, solution.variables)]
+
+
+def minimization_signs(problem):
+    # Signs that turn the objectives of a problem into minimization objectives
+    # (directions are Direction enums since Platypus 1.1, plain integers before)
+    return array([-1.0 if getattr(d, "value", d)==Problem.MAXIMIZE else 1.0 for d in problem.directions])
+
+
+def estimated(solution):
+    # True if the objectives of the solution were estimated by an evaluator
+    # (e.g., predicted by Surrogate_Evaluator) instead of simulated
+    return getattr(solution, "estimated", False)
+
+
+def simulated(solutions):
+    # The evaluated solutions whose objectives were simulated
+    return [s for s in solutions if s.evaluated and not estimated(s)]
+
+
+def _evaluate_all(evaluator, jobs, **kwargs):
+    # evaluator.evaluate_all(jobs) by an evaluator that wraps another one. The
+    # estimating evaluators always simulate the solutions with estimated
+    # objectives, so these are marked as simulated once evaluated
+    flagged = [job.solution for job in jobs if estimated(job.solution)]
+    results = list(evaluator.evaluate_all(jobs, **kwargs))
+    for solution in flagged:
+        solution.estimated = False
+    return results
+
+
+class Final_Simulation(TerminationCondition):
+
+    def __init__(self, condition):
+        # Termination of the runs whose evaluator estimates objectives
+        # (Surrogate_Evaluator, Multi_Fidelity_Evaluator): when `condition` (or
+        # a number of FEs) stops the run, the members of algorithm.result with
+        # estimated objectives are simulated with the evaluator of the
+        # algorithm before the run returns, so that the results, their
+        # hypervolume and the fronts written only hold simulated objectives.
+        # These simulations are counted in algorithm.nfe
+        super().__init__()
+        self.condition = MaxEvaluations(condition) if isinstance(condition, int) else condition
+
+    def initialize(self, algorithm):
+        self.condition.initialize(algorithm)
+
+    def shouldTerminate(self, algorithm):
+        if not self.condition(algorithm):
+            return False
+        members = [s for s in algorithm.result if estimated(s)]
+        for solution in members:
+            solution.evaluated = False
+        if members:
+            algorithm.evaluate_all(members)
+        return True
+
+
+def dominated(points, front):
+    # Mask of the points (rows, minimization) dominated by at least one point of front
+    points, front = asarray(points, dtype=float), asarray(front, dtype=float)
+    if len(front)==0 or len(points)==0:
+        return zeros(len(points), dtype=bool)
+    weakly = (front[None, :, :]<=points[:, None, :]).all(axis=2)
+    strictly = (front[None, :, :]<points[:, None, :]).any(axis=2)
+    return (weakly & strictly).any(axis=1)
+
+
+def nondominated_mask(points, chunk=1000):
+    # Mask of the points (rows, minimization) not dominated by any other point.
+    # Large sets are filtered in chunks by increasing sum of the objectives, as
+    # a point can only be dominated by points with a smaller sum
+    points = asarray(points, dtype=float)
+    if len(points)<=chunk:
+        return ~dominated(points, points)
+    mask = zeros(len(points), dtype=bool)
+    order = argsort(points.sum(axis=1), kind="stable")
+    front = points[:0]
+    for start in range(0, len(points), chunk):
+        index = order[start:start+chunk]
+        index = index[~dominated(points[index], front)]
+        index = index[~dominated(points[index], points[index])]
+        mask[index] = True
+        front = concatenate([front, points[index]])
+    return mask
+
+
+class Surrogate_Evaluator(Evaluator):
+
+    def __init__(self, evaluator, model="knn", k=5, retrain_interval=100, exploration=0.1, warmup=200,
+            complexity=True, seed=None, verbose=False):
+        # Pre-screening of the offspring with a surrogate model of the fitness,
+        # trained online on every perturbation actually simulated: "knn" (mean
+        # of the k nearest genotypes in Hamming distance over the genes) or
+        # "forest" (random forest, if scikit-learn is installed). Only the
+        # solutions predicted non-dominated by the simulated ones, and a random
+        # `exploration` fraction of the others, are passed to `evaluator`; the
+        # others get the predicted objectives and are marked as estimated (see
+        # estimated and Final_Simulation); solutions already marked are always
+        # simulated. The model is refitted every
+        # retrain_interval simulations and used after `warmup` simulations.
+        # With complexity=True the last objective is the number of perturbed
+        # genes, which is computed exactly. verbose=True prints report() at every refit
+        if model not in ("knn", "forest"):
+            raise Exception("ERROR: unknown surrogate model '%s', use 'knn' or 'forest'" % model)
+        if model=="forest" and RandomForestRegressor is None:
+            print(" * scikit-learn is not available, falling back to the knn surrogate")
+            model = "knn"
+        super().__init__()
+        self.evaluator = evaluator
+        self.model = model
+        self.k = k
+        self.retrain_interval = retrain_interval
+        self.exploration = exploration
+        self.warmup = warmup
+        self.complexity = complexity
+        self.verbose = verbose
+        self._random = Random(seed)
+        self._genotypes = []
+        self._objectives = []
+        self._trained = 0
+        self._forest = None
+        self.simulations = 0
+        self.saved = 0
+
+    def evaluate_all(self, jobs, **kwargs):
+        jobs = list(jobs)
+        if not all(isinstance(job, EvaluateSolution) for job in jobs):
+            return self.evaluator.evaluate_all(jobs, **kwargs)
+        if len(self._genotypes)<self.warmup:
+            return self._simulate(jobs, **kwargs)
+
+        if len(self._genotypes)-self._trained>=self.retrain_interval or self._trained==0:
+            self._train()
+            if self.verbose:
+                self.report()
+        problem = jobs[0].solution.problem
+        signs = minimization_signs(problem)
+        genotypes = array([decode(job.solution) for job in jobs], dtype=int64)
+        predicted = self.predict(genotypes)
+        front = asarray(self._objectives)*signs
+        front = front[nondominated_mask(front)]
+        promising = ~dominated(predicted*signs, front)
+
+        selected = [i for i in range(len(jobs)) if estimated(jobs[i].solution) or promising[i]
+            or self._random.random()<self.exploration]
+        results = list(jobs)
+        for i, result in zip(selected, self._simulate([jobs[i] for i in selected], **kwargs)):
+            results[i] = result
+        for i in set(range(len(jobs)))-set(selected):
+            solution = jobs[i].solution
+            solution.objectives[:] = predicted[i].tolist()
+            solution.evaluated = True
+            solution.estimated = True
+        self.saved += len(jobs)-len(selected)
+        return results
+
+    def _simulate(self, jobs, **kwargs):
+        results = _evaluate_all(self.evaluator, jobs, **kwargs)
+        for job, result in zip(jobs, results):
+            if not estimated(job.solution):
+                self._genotypes.append(decode(result.solution))
+                self._objectives.append(list(result.solution.objectives))
+        self.simulations += len(results)
+        return results
+
+    def _train(self):
+        self._X = array(self._genotypes, dtype=int64)
+        self._Y = array(self._objectives, dtype=float)
+        self._trained = len(self._genotypes)
+        if self.model=="forest":
+            self._forest = RandomForestRegressor(n_estimators=100, random_state=self._random.randint(0, 2**31-1))
+            # One-hot encoding of the levels of the genes
+            self._forest.fit(concatenate([self._X==level for level in (0, 1, 2)], axis=1), self._Y)
+
+    def predict(self, genotypes):
+        # Predicted objectives of the genotypes (rows)
+        genotypes = asarray(genotypes, dtype=int64)
+        if self.model=="forest":
+            predicted = self._forest.predict(concatenate([genotypes==level for level in (0, 1, 2)], axis=1))
+        else:
+            distances = (genotypes[:, None, :]!=self._X[None, :, :]).sum(axis=2)
+            k = min(self.k, len(self._X))
+            nearest = argpartition(distances, k-1, axis=1)[:, :k]
+            predicted = self._Y[nearest].mean(axis=1)
+            # Genotypes already simulated get their true objectives
+            exact = distances.min(axis=1)==0
+            predicted[exact] = self._Y[distances[exact].argmin(axis=1)]
+        if self.complexity:
+            predicted[:, -1] = (genotypes>0).sum(axis=1)
+        return predicted
+
+    def report(self):
+        total = self.simulations+self.saved
+        print(" * Surrogate (%s): %d solutions, %d simulated, %d simulations saved (%.1f%%)" % (self.model,
+            total, self.simulations, self.saved, 100.*self.saved/total if total>0 else 0.0))
+
+    def close(self):
+        self.evaluator.close()
+
+
+class Dedup_Evaluator(Evaluator):
+
+    def __init__(self, evaluator, verbose=False):
+        # Evaluates each distinct genotype of a batch (i.e., of a generation)
+        # once with `evaluator`, and copies the results to its duplicates (a
+        # solution with estimated objectives represents its duplicates, so that
+        # it is simulated). The
+        # duplicate rate of every batch is kept in self.rates and printed if
+        # verbose; report() prints the totals
+        super().__init__()
+        self.evaluator = evaluator
+        self.verbose = verbose
+        self.rates = []
+        self.solutions = 0
+        self.duplicates = 0
+
+    def evaluate_all(self, jobs, **kwargs):
+        jobs = list(jobs)
+        if not all(isinstance(job, EvaluateSolution) for job in jobs):
+            return self.evaluator.evaluate_all(jobs, **kwargs)
+        groups = OrderedDict()
+        for i, job in enumerate(jobs):
+            groups.setdefault(tuple(decode(job.solution)), []).append(i)
+        for indices in groups.values():
+            indices.sort(key=lambda i: not estimated(jobs[i].solution))
+        unique = [indices[0] for indices in groups.values()]
+        results = list(jobs)
+        for indices, result in zip(groups.values(), _evaluate_all(self.evaluator, [jobs[i] for i in unique], **kwargs)):
+            results[indices[0]] = result
+            for i in indices[1:]:
+                # Evaluation also re-encodes the variables (a genotype has several binary encodings)
+                solution = jobs[i].solution
+                solution.variables[:] = deepcopy(result.solution.variables[:])
+                solution.objectives[:] = result.solution.objectives[:]
+                solution.constraints[:] = result.solution.constraints[:]
+                solution.constraint_violation = result.solution.constraint_violation
+                solution.feasible = getattr(result.solution, "feasible", True)
+                solution.evaluated = True
+                solution.estimated = estimated(jobs[indices[0]].solution)
+        duplicates = len(jobs)-len(unique)
+        self.rates.append(duplicates/float(len(jobs)) if jobs else 0.0)
+        self.solutions += len(jobs)
+        self.duplicates += duplicates
+        if self.verbose:
+            print(" * Batch of %d solutions: %d duplicates (%.1f%%)" % (len(jobs), duplicates, 100*self.rates[-1]))
+        return results
+
+    def report(self):
+        print(" * Deduplication: %d solutions, %d duplicates not evaluated (%.1f%%)" % (self.solutions,
+            self.duplicates, 100.*self.duplicates/self.solutions if self.solutions>0 else 0.0))
+
+    def close(self):
+        self.evaluator.close()
+
+
+def rank_correlation(x, y):
+    # Spearman's rank correlation (ties are ranked by position)
+    rx, ry = argsort(argsort(x)), argsort(argsort(y))
+    if rx.std()==0 or ry.std()==0:
+        return 1.0 if (asarray(x)==asarray(y)).all() else 0.0
+    return float(corrcoef(rx, ry)[0, 1])
+
+
+class Multi_Fidelity_Evaluator(Evaluator):
+
+    def __init__(self, evaluator, cheap, margin=0.05, target_correlation=0.9, adapt=1.25,
+            min_margin=0.0, max_margin=1.0, window=500, verbose=False):
+        # Two-level evaluation: `cheap` maps a list of genotypes to their
+        # objectives at the cheap level (e.g., the fitness_batch of a
+        # Model_Simulator with a coarser time grid), and only the solutions that
+        # the cheap level places near the front of the fully evaluated ones are
+        # promoted to `evaluator`; the others keep the cheap objectives and are
+        # marked as estimated, so that they are evaluated at full fidelity when
+        # they are evaluated again or reach the result (see Final_Simulation),
+        # and solutions already marked are always promoted. A solution is near
+        # the front if it is not dominated by the front worsened
+        # by `margin` (a fraction of the range of each objective). The rank
+        # correlation between the two levels over the last `window` promoted
+        # solutions tunes the margin: it shrinks (by `adapt`) while the
+        # correlation is at least target_correlation, and grows otherwise
+        super().__init__()
+        self.evaluator = evaluator
+        self.cheap = cheap
+        self.margin = margin
+        self.target_correlation = target_correlation
+        self.adapt = adapt
+        self.min_margin = min_margin
+        self.max_margin = max_margin
+        self.verbose = verbose
+        self._pairs = deque(maxlen=window)
+        self._full = []
+        self.cheap_evaluations = 0
+        self.full_evaluations = 0
+        self.correlations = []
+
+    def evaluate_all(self, jobs, **kwargs):
+        jobs = list(jobs)
+        if not all(isinstance(job, EvaluateSolution) for job in jobs):
+            return self.evaluator.evaluate_all(jobs, **kwargs)
+        signs = minimization_signs(jobs[0].solution.problem)
+        cheap = array(self.cheap([decode(job.solution) for job in jobs]), dtype=float)
+        self.cheap_evaluations += len(jobs)
+
+        if self._full:
+            full = array(self._full)*signs
+            scale = full.max(axis=0)-full.min(axis=0)
+            scale[scale==0] = 1.0
+            front = full[nondominated_mask(full)]
+            promoted = ~dominated(cheap*signs, front+self.margin*scale)
+        else:
+            promoted = array([True]*len(jobs))
+        promoted |= array([estimated(job.solution) for job in jobs], dtype=bool)
+
+        selected = [i for i in range(len(jobs)) if promoted[i]]
+        results = list(jobs)
+        for i, result in zip(selected, _evaluate_all(self.evaluator, [jobs[i] for i in selected], **kwargs)):
+            results[i] = result
+            if not estimated(jobs[i].solution):
+                # Full-fidelity objectives (not estimated by an inner evaluator)
+                self._full.append(list(result.solution.objectives))
+                self._pairs.append((cheap[i], array(result.solution.objectives, dtype=float)))
+        for i in range(len(jobs)):
+            if not promoted[i]:
+                jobs[i].solution.objectives[:] = cheap[i].tolist()
+                jobs[i].solution.evaluated = True
+                jobs[i].solution.estimated = True
+        self.full_evaluations += len(selected)
+        self._tune()
+        return results
+
+    def _tune(self):
+        # Adapt the margin to the rank correlation between the levels
+        if len(self._pairs)<10:
+            return
+        cheap, full = array([pair[0] for pair in self._pairs]), array([pair[1] for pair in self._pairs])
+        correlation = min(rank_correlation(cheap[:, j], full[:, j]) for j in range(cheap.shape[1]))
+        self.correlations.append(correlation)
+        if correlation>=self.target_correlation:
+            self.margin = max(self.min_margin, self.margin/self.adapt)
+        else:
+            self.margin = min(self.max_margin, self.margin*self.adapt)
+        if self.verbose:
+            self.report()
+
+    def report(self):
+        print(" * Multi-fidelity: %d cheap and %d full evaluations (%.1f%% promoted), rank correlation %.3f, margin %.3f" % (
+            self.cheap_evaluations, self.full_evaluations, 100.*self.full_evaluations/max(1, self.cheap_evaluations),
+            self.correlations[-1] if self.correlations else float("nan"), self.margin))
+
+    def close(self):
+        self.evaluator.close()
+
+
+def local_search(algorithm, fitness_batch, max_rounds=None, known=None, verbose=False):
+    # Memetic refinement of algorithm.result over the Hamming-1 neighbourhood:
+    # for every solution, all the genotypes that differ in one gene (32 for 16
+    # ternary genes) are evaluated as one batch with fitness_batch (e.g.,
+    # Model_Simulator.fitness_batch). For every solution with a neighbour that
+    # dominates it, that neighbour is merged into the result, which is then
+    # rebuilt as a non-dominated archive: the non-dominated solutions among the
+    # members and the neighbours, one per genotype (an Archive just adds the
+    # neighbours, and drops the dominated solutions itself). The neighbours
+    # inherit the bookkeeping attributes of the solution they improve (rank,
+    # crowding distance, SPEA2 fitness). Rounds are repeated until no
+    # solution improves (or max_rounds). `known` is
+    # a dictionary genotype -> objectives shared across calls, so neighbours are
+    # never simulated twice. The simulations are added to algorithm.nfe.
+    # Returns the number of solutions improved
+    problem = algorithm.problem
+    signs = minimization_signs(problem)
+    known = {} if known is None else known
+    improved = rounds = 0
+    while max_rounds is None or rounds<max_rounds:
+        members = simulated(algorithm.result)
+        genotypes = [decode(s) for s in members]
+        neighbourhoods = []
+        for genotype in genotypes:
+            neighbourhoods.append([tuple(genotype[:i]+[level]+genotype[i+1:])
+                for i, t in enumerate(problem.types) for level in range(t.min_value, t.max_value+1) if level!=genotype[i]])
+        unknown = list(OrderedDict.fromkeys(n for neighbours in neighbourhoods for n in neighbours if n not in known))
+        if unknown:
+            for genotype, objectives in zip(unknown, fitness_batch([list(n) for n in unknown])):
+                known[genotype] = list(objectives)
+            algorithm.nfe += len(unknown)
+        rounds += 1
+
+        replacements = []
+        for member, neighbours in zip(members, neighbourhoods):
+            objectives = array([known[n] for n in neighbours], dtype=float)*signs
+            point = array(member.objectives[:], dtype=float)*signs
+            dominating = ((objectives<=point).all(axis=1) & (objectives<point).any(axis=1)).nonzero()[0]
+            if len(dominating)==0:
+                continue
+            # The first neighbour not dominated by the other improvements
+            best = dominating[nondominated_mask(objectives[dominating]).argmax()]
+            replacements.append((member, neighbours[best]))
+        if verbose:
+            print(" * Local search, round %d: %d solutions, %d neighbours simulated, %d improved" % (
+                rounds, len(members), len(unknown), len(replacements)))
+        if not replacements:
+            break
+
+        result = algorithm.result
+        neighbours = []
+        for member, genotype in replacements:
+            neighbour = deepcopy(member)
+            neighbour.variables[:] = [t.encode(v) for t, v in zip(problem.types, genotype)]
+            neighbour.objectives[:] = known[genotype]
+            if isinstance(result, list):
+                neighbours.append(neighbour)
+            else:
+                result.add(neighbour)
+        if isinstance(result, list):
+            # Non-dominated, genotype-unique union of the members and the neighbours
+            unique = OrderedDict()
+            for solution in result+neighbours:
+                unique.setdefault(tuple(decode(solution)), solution)
+            union = list(unique.values())
+            front = nondominated_mask(array([list(s.objectives) for s in union], dtype=float)*signs)
+            result[:] = [s for s, keep in zip(union, front) if keep]
+        improved += len(replacements)
+    return improved
+
+
+def model_hash(SIM):
+    # Hash of everything the fitness of a Model_Simulator depends on: rules and
+    # fuzzy sets (the source generated by fuzzy_engine), initial state,
+    # perturbed variables, Glucose schedule, readout timepoint, the definition
+    # of fitness_batch, the settings of the backend configured by set_backend
+    # that change the results (precision other than double, lookup tables),
+    # and the perturbation model, if not the default one. Exact backends give
+    # the same results as the stream, so they do not change the hash
+    module = modules[type(SIM).__module__]
+    SIM._reset_variables()
+    parts = [generate_source(Compiled_Model(SIM.FS, sparse=False)),
+        repr(sorted(SIM.FS._variables.items())),
+        repr(SIM._sorted_names),
+        repr([module.time_function(T) for T in SIM._timepoints(SIM._max_steps)]),
+        repr(SIM._readout),
+        getsource(type(SIM).fitness_batch)]
+    batch = SIM._batch
+    if batch is not None and (batch.precision!="double" or batch.lookup is not None):
+        parts.append(repr((batch.precision, batch.lookup, batch.resolution if batch.lookup is not None else None)))
+    if SIM._perturbation_model.semantics!="before_inference":
+        parts.append(repr(SIM._perturbation_model.semantics))
+    return sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class Fitness_Cache(object):
+
+    def __init__(self, SIM, cache_dir=None, merge_interval=100000):
+        # Persistent cache of the objectives of SIM.fitness_batch, stored in
+        # cache_dir as fitness_<model_hash>.npz, so that it is reused only by the
+        # same model and fitness. Genotypes are keyed by their base-3 index;
+        # keys are kept in a sorted array (searched in batch), and new entries
+        # in a dictionary merged into it every merge_interval entries. Calling
+        # the cache is a drop-in for fitness_batch (e.g., in local_search)
+        self.fitness_batch = SIM.fitness_batch
+        self.model_hash = model_hash(SIM)
+        if cache_dir is None:
+            cache_dir = path.join(path.dirname(path.abspath(__file__)), "__fitnesscache__")
+        self.filename = path.join(cache_dir, "fitness_%s.npz" % self.model_hash)
+        self.merge_interval = merge_interval
+        self._powers = 3**arange(len(SIM._sorted_names), dtype=int64)
+        self._keys, self._values = zeros(0, dtype=int64), None
+        self._pending = {}
+        if path.exists(self.filename):
+            with load(self.filename) as archive:
+                self._keys, self._values = archive["keys"], archive["values"]
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._keys)+len(self._pending)
+
+    def __call__(self, genotypes):
+        genotypes = asarray(genotypes, dtype=int64).reshape(-1, len(self._powers))
+        keys = genotypes.dot(self._powers)
+        index = searchsorted(self._keys, keys).clip(0, max(0, len(self._keys)-1))
+        stored = (self._keys[index]==keys) if len(self._keys)>0 else zeros(len(keys), dtype=bool)
+
+        missing = OrderedDict()
+        for i in (~stored).nonzero()[0]:
+            if keys[i] not in self._pending and keys[i] not in missing:
+                missing[keys[i]] = i
+        if missing:
+            for key, objectives in zip(missing, self.fitness_batch(genotypes[list(missing.values())].tolist())):
+                self._pending[key] = objectives
+        self.misses += len(missing)
+        self.hits += len(keys)-len(missing)
+
+        if len(keys)==0:
+            return zeros((0, 0))
+        width = self._values.shape[1] if self._values is not None else len(next(iter(self._pending.values())))
+        values = zeros((len(keys), width))
+        values[stored] = self._values[index[stored]] if stored.any() else 0.0
+        for i in (~stored).nonzero()[0]:
+            values[i] = self._pending[keys[i]]
+        if len(self._pending)>=self.merge_interval:
+            self._merge()
+        return values
+
+    def _merge(self):
+        if not self._pending:
+            return
+        keys = concatenate([self._keys, array(list(self._pending), dtype=int64)])
+        pending = array(list(self._pending.values()), dtype=float)
+        values = pending if self._values is None else concatenate([self._values, pending])
+        order = argsort(keys, kind="stable")
+        self._keys, self._values = keys[order], values[order]
+        self._pending = {}
+
+    def save(self):
+        # Write the cache (atomically, so that concurrent runs never read a partial file)
+        self._merge()
+        if self._values is None:
+            return
+        makedirs(path.dirname(self.filename), exist_ok=True)
+        temporary = "%s.%d.npz" % (self.filename[:-4], getpid())
+        savez(temporary, keys=self._keys, values=self._values)
+        replace(temporary, self.filename)
+
+    def report(self):
+        total = self.hits+self.misses
+        print(" * Fitness cache: %d genotypes, %d lookups, %d simulated (%.1f%% hits)" % (len(self), total,
+            self.misses, 100.*self.hits/total if total>0 else 0.0))
+
+
+def read_paretofront(filename, names):
+    # Genotypes of a result-paretofront.txt file ("Gene IS low, Gene IS high"
+    # per line, genes not listed are not perturbed); [] if there is no file
+    if not path.exists(filename):
+        return []
+    levels = {"low": 1, "high": 2}
+    genotypes = []
+    with open(filename) as fi:
+        for line in fi:
+            genotype = [0]*len(names)
+            for item in filter(None, (item.strip() for item in line.split(","))):
+                name, level = item.split(" IS ")
+                genotype[names.index(name)] = levels[level]
+            genotypes.append(genotype)
+    return genotypes
+
+
+def fe_to_reach(history, target):
+    # FEs after which a run first reached a hypervolume, from its (nfe, hypervolume) history
+    for nfe, hypervolume in history:
+        if hypervolume>=target:
+            return nfe
+    return None
+
+
+class Front_Hypervolume(object):
+
+    def __init__(self, hypervolume):
+        # Hypervolume (Platypus indicator) of the non-dominated simulated
+        # solutions of a result, with a cache of the last front: the value is
+        # computed from scratch whenever the non-dominated objectives differ from
+        # those of the previous call, and reused otherwise (no incremental
+        # update). self.computed counts the computations
+        self.hypervolume = hypervolume
+        self.computed = 0
+        self._front = None
+        self._value = None
+
+    def __call__(self, solutions):
+        solutions = simulated(solutions)
+        if solutions:
+            objectives = array([list(s.objectives) for s in solutions], dtype=float)
+            mask = nondominated_mask(objectives*minimization_signs(solutions[0].problem))
+        else:
+            objectives, mask = array([]), array([], dtype=bool)
+        front = frozenset(map(tuple, objectives[mask].tolist()))
+        if front!=self._front:
+            self._front = front
+            self._value = self.hypervolume.calculate([s for s, m in zip(solutions, mask) if m])
+            self.computed += 1
+        return self._value
+
+
+class Hypervolume_Log(object):
+
+    def __init__(self, hypervolume):
+        # Callback of algorithm.run() that records (nfe, hypervolume of the
+        # simulated solutions of the result) after every generation, with a
+        # Platypus Hypervolume indicator; see Front_Hypervolume for when it is
+        # computed
+        self.hypervolume = Front_Hypervolume(hypervolume)
+        self.history = []
+
+    def __call__(self, algorithm):
+        self.history.append((algorithm.nfe, self.hypervolume(algorithm.result)))
+
+
+class Front_Archive(object):
+
+    def __init__(self, SIM, cache_dir=None):
+        # Non-dominated perturbations found by the runs on a model, stored in
+        # cache_dir as front_<model_hash>.npz (see model_hash), together with the
+        # hypervolume history of the first unseeded run, the reference of report()
+        self.model_hash = model_hash(SIM)
+        if cache_dir is None:
+            cache_dir = path.join(path.dirname(path.abspath(__file__)), "__fitnesscache__")
+        self.filename = path.join(cache_dir, "front_%s.npz" % self.model_hash)
+        self._genotypes, self._objectives, self.reference = zeros((0, len(SIM._sorted_names)), dtype=int64), None, None
+        if path.exists(self.filename):
+            with load(self.filename) as archive:
+                self._genotypes, self._objectives = archive["genotypes"], archive["objectives"]
+                self.reference = archive["reference"] if len(archive["reference"])>0 else None
+
+    def __len__(self):
+        return len(self._genotypes)
+
+    def genotypes(self):
+        return self._genotypes.tolist()
+
+    def update(self, solutions, history=None, seeded=False):
+        # Merge the (simulated) solutions of a run into the archive, keeping
+        # the non-dominated ones; history is the hypervolume history of the run,
+        # kept as reference only if the run was not seeded (e.g., by Warm_Start)
+        solutions = simulated(solutions)
+        if not solutions:
+            return
+        signs = minimization_signs(solutions[0].problem)
+        genotypes = concatenate([self._genotypes, array([decode(s) for s in solutions], dtype=int64)])
+        objectives = array([list(s.objectives) for s in solutions], dtype=float)
+        if self._objectives is not None:
+            objectives = concatenate([self._objectives, objectives])
+        unique = list(OrderedDict((tuple(g), i) for i, g in enumerate(genotypes.tolist())).values())
+        genotypes, objectives = genotypes[unique], objectives[unique]
+        front = nondominated_mask(objectives*signs)
+        self._genotypes, self._objectives = genotypes[front], objectives[front]
+        if self.reference is None and history and not seeded:
+            self.reference = array(history, dtype=float)
+
+    def save(self):
+        if self._objectives is None:
+            return
+        makedirs(path.dirname(self.filename), exist_ok=True)
+        temporary = "%s.%d.npz" % (self.filename[:-4], getpid())
+        savez(temporary, genotypes=self._genotypes, objectives=self._objectives,
+            reference=self.reference if self.reference is not None else zeros((0, 2)))
+        replace(temporary, self.filename)
+
+    def report(self, history):
+        # FEs saved by a (warm started) run with the given hypervolume history:
+        # FEs it needed to reach the final hypervolume of the reference run,
+        # against the FEs the reference run needed
+        if self.reference is None or not history:
+            print(" * Warm start: no reference run for this model yet")
+            return
+        target = self.reference[-1][1]
+        reference, warm = fe_to_reach(self.reference.tolist(), target), fe_to_reach(history, target)
+        if warm is None:
+            print(" * Warm start: hypervolume %.4f of the reference run not reached (best %.4f)" % (target,
+                max(hypervolume for _, hypervolume in history)))
+        else:
+            print(" * Warm start: hypervolume %.4f reached after %d FEs instead of %d (%.1f%% FEs saved)" % (target,
+                warm, reference, 100.*(reference-warm)/reference))
+
+
+class Warm_Start(Generator):
+
+    def __init__(self, genotypes, population_size, fraction=0.5, candidates=20, seed=None):
+        # Generator of the initial population: a random sample of at most
+        # fraction*population_size of the genotypes (e.g., Front_Archive.genotypes()),
+        # then random genotypes chosen for diversity, each the farthest from the
+        # population so far (Hamming distance) among `candidates` random ones
+        super().__init__()
+        self._random = Random(seed)
+        genotypes = [list(g) for g in genotypes]
+        self._seeds = self._random.sample(genotypes, min(len(genotypes), int(fraction*population_size)))
+        self.candidates = candidates
+        self._population = []
+
+    def generate(self, problem):
+        if self._seeds:
+            genotype = self._seeds.pop()
+        else:
+            candidates = [[self._random.randint(t.min_value, t.max_value) for t in problem.types] for _ in range(self.candidates)]
+            if self._population:
+                population = array(self._population)
+                genotype = max(candidates, key=lambda c: (population!=c).sum(axis=1).min())
+            else:
+                genotype = candidates[0]
+        self._population.append(genotype)
+        solution = Solution(problem)
+        solution.variables[:] = [t.encode(v) for t, v in zip(problem.types, genotype)]
+        return solution
+
+
+class Hypervolume_Stagnation(TerminationCondition):
+
+    def __init__(self, max_evaluations, hypervolume, patience=20, epsilon=1e-4, verbose=True):
+        # Termination of algorithm.run() (or of experiment(), as nfe) when the
+        # hypervolume of the result has not improved by more than epsilon for
+        # `patience` generations, or after max_evaluations FEs. hypervolume is a
+        # Platypus indicator (higher is better), computed from scratch when the
+        # non-dominated objectives of the result change and reused from the
+        # previous generation otherwise (see Front_Hypervolume). The FEs consumed
+        # are in self.consumed and printed at the end of the run if verbose
+        super().__init__()
+        self.max_evaluations = max_evaluations
+        self.hypervolume = hypervolume
+        self.patience = patience
+        self.epsilon = epsilon
+        self.verbose = verbose
+
+    def initialize(self, algorithm):
+        self.starting_nfe = algorithm.nfe
+        self.best = -inf
+        self.stagnant = 0
+        self.history = []
+        self.consumed = None
+        self._hypervolume = Front_Hypervolume(self.hypervolume)
+
+    def shouldTerminate(self, algorithm):
+        consumed = algorithm.nfe-self.starting_nfe
+        solutions = simulated(getattr(algorithm, "result", None) or [])
+        if solutions:
+            value = self._hypervolume(solutions)
+            self.history.append((algorithm.nfe, value))
+            if value>self.best+self.epsilon:
+                self.best, self.stagnant = value, 0
+            else:
+                self.stagnant += 1
+
+        stagnated = self.stagnant>=self.patience
+        if stagnated or consumed>=self.max_evaluations:
+            self.consumed = consumed
+            if self.verbose:
+                print(" * %s stopped after %d FEs (%s), hypervolume %.4f, computed in %d of %d generations" % (
+                    type(algorithm).__name__, consumed, "no improvement for %d generations" % self.patience if stagnated
+                    else "maximum FEs", self.best, self._hypervolume.computed, len(self.history)))
+            return True
+        return False
@@ -0,0 +1,82 @@
+#########################################################################################################
+# Semantics of the perturbations of the dynamic fuzzy models, and reduction of the perturbations
+# to the equivalent ones that clamp only the genes able to change the recorded outputs. A clamped
+# variable holds its value at every inference whatever its inputs, so it cuts the influence of
+# the variables upstream: with the influence graph of the rule base, the genes whose clamp cannot
+# reach the recorded variables within the recorded steps can be left unperturbed, and the
+# perturbations that differ only in those genes are simulated once.
+#########################################################################################################
+
+from numpy import asarray, int64, where, zeros
+from fuzzy_engine import Compiled_Model
+
+# "before_inference": the perturbed variables are clamped before each inference,
+# and the state after the step holds their inferred values (Simpful's loop);
+# "after_update": they are clamped again after the update, so that the state
+# always holds the clamped values. The other variables have the same dynamics
+PERTURBATION_MODELS = ("before_inference", "after_update")
+
+
+class Perturbation_Model(object):
+
+    def __init__(self, FS, perturbed, semantics="before_inference"):
+        # perturbed lists the variables of FS set by the genes of a perturbation
+        # (0: unperturbed, 1: low, 2: high); semantics is one of PERTURBATION_MODELS
+        if semantics not in PERTURBATION_MODELS:
+            raise Exception("ERROR: unknown perturbation model '%s', available models: %s" % (semantics, ", ".join(PERTURBATION_MODELS)))
+        self.semantics = semantics
+        model = Compiled_Model(FS, sparse=False)
+        self.variables = model.variables
+        self._var_index = model._var_index
+        self.perturbed = asarray([model._var_index[var] for var in perturbed], dtype=int64)
+        # Influence graph: _parents[o, p] if a rule of o mentions p
+        self._parents = zeros((len(self.variables), len(self.variables)), dtype=bool)
+        for p, outputs in model._dependents.items():
+            for o in outputs:
+                self._parents[o, p] = True
+        self._never = {}
+
+    def influence(self, perturbations, targets, steps):
+        # Boolean array (perturbations, genes): the perturbed genes whose clamp
+        # can change the values of the variables `targets` within `steps`
+        # inference steps. The influence is propagated backwards from the
+        # targets, one edge per step, and stops at the clamped variables; under
+        # "before_inference" the inferred values of clamped targets are recorded,
+        # so the influence still reaches them, while under "after_update" a
+        # clamped target is fixed by its own gene
+        codes = asarray(perturbations, dtype=int64).reshape(-1, len(self.perturbed))
+        clamped = zeros((len(codes), len(self.variables)), dtype=bool)
+        clamped[:, self.perturbed] = codes>0
+        target = zeros(len(self.variables), dtype=bool)
+        target[[self._var_index[var] for var in targets]] = True
+        start = target if self.semantics=="before_inference" else zeros(len(self.variables), dtype=bool)
+        reached = zeros(clamped.shape, dtype=bool) | target
+        upstream = zeros(clamped.shape, dtype=bool)
+        for _ in range(steps):
+            new = (reached & (~clamped | start)).dot(self._parents) & ~upstream
+            if not new.any():
+                break
+            upstream |= new
+            reached |= new
+        if self.semantics=="after_update" and steps>0:
+            upstream |= target
+        return upstream[:, self.perturbed] & (codes>0)
+
+    def never_influence(self, targets, steps):
+        # Genes that cannot change the targets whatever the other genes, i.e.
+        # not even when perturbed alone (clamping other genes only cuts paths);
+        # precomputed once for each (targets, steps)
+        key = (tuple(targets), steps)
+        if key not in self._never:
+            alone = self.influence([[2 if i==j else 0 for i in range(len(self.perturbed))] for j in range(len(self.perturbed))],
+                targets, steps)
+            self._never[key] = [j for j in range(len(self.perturbed)) if not alone[j, j]]
+        return self._never[key]
+
+    def reduce(self, perturbations, targets, steps):
+        # Equivalent perturbations (array (perturbations, genes)): the same
+        # values of the targets within `steps` steps, with the genes that cannot
+        # change them left unperturbed
+        codes = asarray(perturbations, dtype=int64).reshape(-1, len(self.perturbed)).copy()
+        codes[:, self.never_influence(targets, steps)] = 0
+        return where(self.influence(codes, targets, steps), codes, 0)
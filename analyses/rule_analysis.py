@@ -0,0 +1,103 @@
+#########################################################################################################
+# Static analysis of the rule base of a dynamic fuzzy model defined with Simpful: duplicated
+# and mergeable rules, subsumed rules, and linguistic variables or terms never referenced.
+# The reduced rule base is run by fuzzy_engine.Compiled_Model(FS, reduce=True); running this
+# file checks it against Simpful on the programmed cell death model.
+#########################################################################################################
+
+from itertools import combinations
+from fuzzy_engine import Compiled_Model
+
+
+def expression(model, n):
+    # Text of node n of the antecedent DAG of a compiled model
+    node = model._nodes[n]
+    if node[0]=="IS":
+        return "(%s IS %s)" % model.terms[node[1]]
+    if node[0]=="NOT":
+        return "NOT (%s)" % expression(model, node[1])
+    a, b = (expression(model, child) for child in node[1:])
+    return "%s %s %s" % (a if model._nodes[node[1]][0]=="IS" else "(%s)" % a,
+        node[0], b if model._nodes[node[2]][0]=="IS" else "(%s)" % b)
+
+
+def rule_text(model, rule):
+    antecedent, output, crisp, weight, multiplicity = rule
+    text = "IF %s THEN (%s = %s)" % (expression(model, antecedent), model.variables[output], crisp)
+    return text if multiplicity==1 else text + " x%d" % multiplicity
+
+
+def analyze_rules(FS, verbose=True):
+    # Returns a dictionary with:
+    # - duplicates: groups of identical rules (same antecedent and consequent)
+    # - mergeable: groups of rules with the same antecedent and output variable,
+    #   whose contributions to the Sugeno weighted average can be summed
+    # - subsumed: pairs (r1, r2) of conjunctive rules with the same consequent,
+    #   where the terms of r1 are a subset of those of r2 (r2 fires only when r1
+    #   fires, and never more). These are reported but kept: in a weighted average
+    #   both rules contribute to the result
+    # - unreferenced_terms/unreferenced_variables: never used in an antecedent
+    # - shared_sets: variables built from the same FuzzySet objects
+    model = Compiled_Model(FS, reduce=False)
+    report = {"duplicates": [], "mergeable": [], "subsumed": []}
+    for group in model.rule_groups():
+        if len(group)>1:
+            consequents = set(model.rules[r][2:4] for r in group)
+            report["duplicates" if len(consequents)==1 else "mergeable"].append(group)
+
+    conjunctive = [r for r, rule in enumerate(model.rules) if model._conjunctive(rule[0])]
+    for r1, r2 in combinations(conjunctive, 2):
+        if model.rules[r1][1:4]!=model.rules[r2][1:4]:
+            continue
+        terms1, terms2 = set(model._rule_terms[r1]), set(model._rule_terms[r2])
+        if terms1<terms2:
+            report["subsumed"].append((r1, r2))
+        elif terms2<terms1:
+            report["subsumed"].append((r2, r1))
+
+    referenced = set(model.referenced_terms())
+    report["unreferenced_terms"] = [model.terms[t] for t in range(len(model.terms)) if t not in referenced]
+    used_variables = set(model.terms[t][0] for t in referenced)
+    report["unreferenced_variables"] = [var for var in model.variables if var not in used_variables]
+
+    report["shared_sets"] = []
+    for var1, var2 in combinations(model.variables, 2):
+        if any(fs1 is fs2 for fs1 in FS._lvs[var1]._FSlist for fs2 in FS._lvs[var2]._FSlist):
+            report["shared_sets"].append((var1, var2))
+
+    if verbose:
+        print(" * %d rules, %d variables, %d terms" % (len(model.rules), len(model.variables), len(model.terms)))
+        print(" * %d groups of duplicated rules, %d groups of mergeable rules" % (len(report["duplicates"]), len(report["mergeable"])))
+        for group in report["duplicates"]+report["mergeable"]:
+            print("   ", " | ".join(rule_text(model, model.rules[r]) for r in group))
+        print(" * %d subsumed rules (kept: both rules contribute to the weighted average)" % len(report["subsumed"]))
+        for r1, r2 in report["subsumed"]:
+            print("   ", rule_text(model, model.rules[r2]), "<=", rule_text(model, model.rules[r1]))
+        print(" * Terms never referenced:", ", ".join("%s IS %s" % term for term in report["unreferenced_terms"]))
+        print(" * Variables never referenced in an antecedent:", ", ".join(report["unreferenced_variables"]))
+        for var1, var2 in report["shared_sets"]:
+            print(" * Variables %s and %s are built from the same fuzzy sets" % (var1, var2))
+        reduced = Compiled_Model(FS, reduce=True)
+        print(" * Reduced rule base: %d rules, %d terms fuzzified" % (len(reduced.rules), len(reduced._referenced)))
+    return report
+
+
+if __name__ == '__main__':
+
+    from random import randint
+    from fuzzy_engine import compare_engines, order_independence
+    from three_obj_optimization_programmed_cell_death_comparison import Model_Simulator
+
+    SIM = Model_Simulator()
+    analyze_rules(SIM.FS)
+
+    # Differential check of the reduced rule base against Simpful
+    perturbations = [[0]*len(SIM._sorted_names)] + [[randint(0,2) for _ in SIM._sorted_names] for _ in range(20)]
+    print(" * Max difference with Simpful: %.3e" % compare_engines(SIM, perturbations, reduce=True))
+
+    # The simulations with the incremental evaluation (also on the specialized models) must not depend on their order
+    for specialize in (False, True):
+        worst = order_independence(SIM, perturbations, incremental=0.2, specialize=specialize)
+        print(" * Max difference between simulation orders (incremental evaluation, specialize=%s): %.3e" % (specialize, worst))
+        if worst>0:
+            raise Exception("ERROR: the incremental evaluation depends on the order of the simulations")
@@ -0,0 +1,243 @@
+#########################################################################################################
+# Simulation of the dynamic fuzzy models, shared by the Model_Simulator classes of the analysis
+# scripts: inference engine and batch backend, streamed and batched simulation, attractors and
+# steady states. The scripts define the model (rules, initial state, perturbed variables and
+# Glucose schedule) and the fitness of their optimization problem.
+#########################################################################################################
+
+from collections import defaultdict, deque
+from numpy import array, asarray, int64, linspace, unique
+from dynamics_analysis import detect_attractor, anderson_fixed_point_batch
+from fuzzy_engine import make_engine
+from batch_engine import Batch_Simulator, available_backends
+
+
+class Simulation_Mixin(object):
+
+    # Inference steps before timepoint 0: 0 if timepoint 0 is the initial state,
+    # 1 if it is the state after the first step
+    _offset = 0
+
+    # The class using the mixin provides self.FS, self._reset_variables(),
+    # self._max_steps, self._sorted_names (perturbed variables), self._outputs,
+    # self._perturbation_model and self._time_function (Glucose schedule)
+
+    def set_engine(self, engine=None, **options):
+        # Inference engine used in the simulations: None for Simpful's
+        # Sugeno_inference, or the name of an engine in fuzzy_engine.ENGINES
+        self._engine = None if engine is None else make_engine(engine, self.FS, **options)
+
+    def set_backend(self, backend=None, **options):
+        # Run simulate() as a whole loop with batch_engine: "numba" (JIT,
+        # if installed), "numpy", or None to step the FuzzySystem with the
+        # inference engine; see active_backend() for the one in use. Options are
+        # passed to batch_engine.Batch_Simulator (e.g., lookup="interpolate")
+        self._batch = None if backend is None else self._batch_simulator(backend, **options)
+
+    def _batch_simulator(self, backend, **options):
+        # Batch_Simulator of the model, its Glucose schedule and perturbation model
+        self._reset_variables()
+        glucose = [self._time_function(T) for T in self._timepoints(self._max_steps)]
+        return Batch_Simulator(self.FS, self._sorted_names, glucose, backend=backend,
+            perturbation_model=self._perturbation_model.semantics, **options)
+
+    def _active_batch(self):
+        # Batch simulator of set_backend, or else a private one with the fastest
+        # backend available (built once), which simulate() never uses
+        if self._batch is not None:
+            return self._batch
+        if getattr(self, "_default_batch", None) is None:
+            self._default_batch = self._batch_simulator(available_backends()[0])
+        return self._default_batch
+
+    def active_backend(self):
+        return "stream" if self._batch is None else self._batch.backend
+
+    def simulate_batch(self, perturbations, record):
+        # Simulate many perturbations at once with batch_engine (see
+        # _active_batch: calling it does not change what simulate() runs);
+        # record=(variables, timepoints). Returns an array (perturbations,
+        # timepoints, variables). Perturbations that differ only in genes that
+        # cannot change the recorded variables (see Perturbation_Model.reduce)
+        # are simulated once
+        batch = self._active_batch()
+        record_vars, record_times = record
+        reduced, inverse = unique(self._perturbation_model.reduce(perturbations, record_vars, max(record_times)+self._offset),
+            axis=0, return_inverse=True)
+        trajectories = batch.simulate(reduced, record=[n+self._offset for n in record_times])
+        return trajectories[:, :, [batch.variables.index(var) for var in record_vars]][inverse.reshape(-1)]
+
+    def _infer(self, engine=None):
+        # One Sugeno inference step on the current state of the model
+        if engine is None:
+            engine = self._engine
+        if engine is None:
+            return self.FS.Sugeno_inference()
+        return engine.Sugeno_inference(self.FS._variables)
+
+    def _specialize(self, perturbation):
+        # Engine specialized for the clamps of a perturbation, if the engine was
+        # created with specialize=True (see Compiled_Model.specialize); None
+        # otherwise. Under "before_inference" the clamped variables are inferred
+        if not getattr(self._engine, "specialized", False):
+            return None
+        clamps = {k: 0.0 if v==1 else 1.0 for k,v in zip(self._sorted_names, perturbation) if v in (1, 2)}
+        return self._engine.specialize(clamps, infer_clamped=self._perturbation_model.semantics=="before_inference")
+
+    def _perturb(self, perturbation):
+        # Clamp the perturbed variables (1: low, 2: high): before each inference,
+        # and again after the update under "after_update"
+        for k,v in zip(self._sorted_names, perturbation):
+            if v==1: #low
+                self.FS.set_variable(k, 0.0)
+            elif v==2: #high
+                self.FS.set_variable(k, 1.0)
+
+    def _timepoints(self, steps):
+        # Same time grid as linspace(0, 1, self._max_steps), continued past T=1
+        # with the same time step for longer horizons
+        times = linspace(0, 1, self._max_steps)
+        for n in range(steps):
+            yield times[n] if n<self._max_steps else n/(self._max_steps-1.)
+
+    def stream(self, perturbation=None, steps=None, history=None, tolerance=None, glucose=None):
+        # Simulate the model with a perturbation, yielding (timepoint, state) one
+        # step at a time, so that consumers can stop as soon as they are done.
+        # Timepoint 0 is the initial state (with _offset=0) or the state after
+        # the first step (with _offset=1); steps defaults to self._max_steps;
+        # history=N keeps only the last N states in self.history (ring buffer)
+        # for O(1) memory on long horizons.
+        # With a tolerance, once the state stops changing (max abs difference
+        # <= tolerance) while Glucose is constant, the following steps are
+        # copied until Glucose changes again; see self.skipped_steps.
+        # glucose holds Glucose at a constant level instead of the schedule
+        if perturbation is None:
+            perturbation = []
+        if steps is None:
+            steps = self._max_steps
+        self.history = deque(maxlen=history) if history is not None else None
+        self.skipped_steps = 0
+        self._reset_variables()
+        kernel = self._specialize(perturbation)
+        engine = self._engine if kernel is None else kernel
+        if hasattr(engine, "reset_state"):
+            # The incremental evaluation starts afresh
+            engine.reset_state()
+
+        state = dict(self.FS._variables)
+        if self._offset==0:
+            if self.history is not None:
+                self.history.append(state)
+            yield 0, state
+        previous = state
+        converged = False
+
+        for n, T in enumerate(self._timepoints(steps), 1-self._offset):
+            level = self._time_function(T) if glucose is None else glucose
+            if converged and level==previous["Glucose"]:
+                # Fixed point under constant inputs: copy the state forward
+                self.skipped_steps += 1
+                state = dict(previous)
+            else:
+                self.FS.set_variable("Glucose", level)
+
+                self._perturb(perturbation)
+
+                new_values = self._infer(kernel)
+
+                self.FS._variables.update(new_values)
+
+                if self._perturbation_model.semantics=="after_update":
+                    self._perturb(perturbation)
+
+                state = dict(self.FS._variables)
+                converged = (tolerance is not None
+                    and state["Glucose"]==previous["Glucose"]
+                    and max(abs(state[k]-previous[k]) for k in state)<=tolerance)
+
+            if self.history is not None:
+                self.history.append(state)
+            yield n, state
+            previous = state
+
+    def simulate(self, perturbation=None, record=None, tolerance=None):
+        # Simulate the model with a perturbation
+        # record=(variables, timepoints) stores only the requested slice of the
+        # dynamics, which is returned as {variable: {timepoint: value}}; the
+        # simulation stops as soon as the last requested timepoint is reached.
+        # tolerance enables the steady-state fast-forward of stream()
+        if self._batch is not None and tolerance is None:
+            return self._simulate_batch(perturbation, record)
+
+        if record is None:
+            # Inferred variables at every timepoint, the others at timepoint 0
+            # if it is the initial state
+            dynamics = defaultdict(list)
+            for n, state in self.stream(perturbation, tolerance=tolerance):
+                for var in (state if n==0 and self._offset==0 else self._outputs):
+                    dynamics[var].append(state[var])
+            return dynamics
+
+        record_vars, record_times = record[0], set(record[1])
+        if perturbation:
+            perturbation = self._perturbation_model.reduce([perturbation], record_vars, max(record_times)+self._offset)[0].tolist()
+        dynamics = {var: {} for var in record_vars}
+        for n, state in self.stream(perturbation, tolerance=tolerance):
+            if n in record_times:
+                for var in record_vars:
+                    dynamics[var][n] = state[var]
+                if n==max(record_times):
+                    break
+        return dynamics
+
+    def _simulate_batch(self, perturbation, record):
+        # simulate() with the batch backend, same output
+        if perturbation is None:
+            perturbation = [0]*len(self._sorted_names)
+        if record is None:
+            trajectory = self._batch.simulate([perturbation])[0]
+            dynamics = defaultdict(list)
+            if self._offset==0:
+                for i, var in enumerate(self._batch.variables):
+                    dynamics[var].extend(trajectory[:, i].tolist() if var in self._outputs else [float(trajectory[0, i])])
+            else:
+                for var in self._outputs:
+                    dynamics[var].extend(trajectory[self._offset:, self._batch.variables.index(var)].tolist())
+            return dynamics
+        record_vars, record_times = record[0], sorted(set(record[1]))
+        values = self.simulate_batch([perturbation], (record_vars, record_times))[0]
+        return {var: dict(zip(record_times, values[:, i].tolist())) for i, var in enumerate(record_vars)}
+
+    def find_attractor(self, perturbation=None, glucose=None, steps=10000, tolerance=1e-9):
+        # Simulate up to `steps` steps (optionally with Glucose held constant) and
+        # stop as soon as a fixed point or a limit cycle is detected
+        return detect_attractor(self.stream(perturbation, steps=steps, glucose=glucose), tolerance=tolerance)
+
+    def steady_state(self, perturbations, glucose=0.0, tolerance=1e-9, max_iterations=1000, memory=5, delay=8, compare=False):
+        # Long-run state of each perturbation with Glucose held constant, solved
+        # as the fixed point of one inference step with Anderson acceleration
+        # (memory=0 is plain iteration). All the perturbations are solved at
+        # once, with one batched inference step per iteration (see
+        # Batch_Simulator.step). compare=True also runs plain iteration to
+        # report the iterations saved by the acceleration
+        batch = self._active_batch()
+        codes = asarray(perturbations, dtype=int64).reshape(-1, len(self._sorted_names))
+        outputs = [batch.variables.index(var) for var in self._outputs]
+        self._reset_variables()
+        initial = array([self.FS._variables[var] for var in batch.variables], dtype=float)
+
+        def step(x, rows):
+            X = initial[None, :].repeat(len(rows), axis=0)
+            X[:, outputs] = x
+            return batch.step(X, codes[rows], glucose)[:, outputs]
+
+        x0 = initial[None, outputs].repeat(len(codes), axis=0)
+        x, iterations, converged, fallbacks = anderson_fixed_point_batch(step, x0, memory=memory, delay=delay,
+            tolerance=tolerance, max_iterations=max_iterations)
+        results = [{"state": dict(zip(self._outputs, x[i].tolist())), "iterations": int(iterations[i]),
+            "converged": bool(converged[i]), "fallbacks": int(fallbacks[i])} for i in range(len(codes))]
+        if compare:
+            plain = anderson_fixed_point_batch(step, x0, memory=0, tolerance=tolerance, max_iterations=max_iterations)
+            for result, n in zip(results, plain[1]):
+                result["iterations_saved"] = int(n)-result["iterations"]
+        return results
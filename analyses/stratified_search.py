@@ -0,0 +1,172 @@
+#########################################################################################################
+# Complexity-stratified search of the perturbations (epsilon-constraint on the complexity):
+# for each number k of perturbed targets, the front of the other objectives over the
+# perturbations of exactly k targets. Levels small enough are enumerated (exact front), the
+# others are searched by branch-and-bound from the perturbations of level k-1 evaluated so far,
+# pruning the ones that cannot improve the front of level k (anytime front).
+#########################################################################################################
+
+from itertools import combinations, product
+from math import comb
+from numpy import array, concatenate, full, inf, isinf, minimum, savetxt, where, zeros
+from optimization_tools import nondominated_mask, dominated
+
+LEVELS = {1: "low", 2: "high"}
+
+
+def level_size(genes, k):
+    # Number of perturbations of exactly k targets
+    return comb(genes, k)*len(LEVELS)**k
+
+
+def level_genotypes(genes, k):
+    # All the perturbations of exactly k targets
+    for targets in combinations(range(genes), k):
+        for levels in product(LEVELS, repeat=k):
+            genotype = [0]*genes
+            for gene, level in zip(targets, levels):
+                genotype[gene] = level
+            yield tuple(genotype)
+
+
+def parents(genotype):
+    # Perturbations with one target less
+    return [genotype[:i]+(0,)+genotype[i+1:] for i, v in enumerate(genotype) if v>0]
+
+
+def children(genotype):
+    # Perturbations with one target more
+    return [genotype[:i]+(level,)+genotype[i+1:] for i, v in enumerate(genotype) if v==0 for level in LEVELS]
+
+
+def _evaluate(fitness_batch, genotypes, signs, batch_size):
+    # Objectives (but complexity, the last one) in minimization form
+    values = [fitness_batch([list(g) for g in genotypes[i:i+batch_size]]) for i in range(0, len(genotypes), batch_size)]
+    return concatenate([array(v, dtype=float)[:, :-1] for v in values])*signs if values else zeros((0, len(signs)))
+
+
+def _update_gain(gain, level, previous):
+    # Best change of the objectives observed when each (gene, level) is added to
+    # an evaluated subset: gain[gene, level-1] (inf if never observed)
+    for genotype, value in level.items():
+        for gene, v in enumerate(genotype):
+            if v>0:
+                parent = genotype[:gene]+(0,)+genotype[gene+1:]
+                if parent in previous:
+                    gain[gene, v-1] = minimum(gain[gene, v-1], value-previous[parent])
+
+
+def _bound(genotype, previous, gain):
+    # Optimistic objectives of a perturbation: for each evaluated subset with one
+    # target less, its objectives plus the best change observed for the missing
+    # target; the tightest of these
+    bounds = [previous[parent]+where(isinf(gain[gene, genotype[gene]-1]), -inf, gain[gene, genotype[gene]-1])
+        for gene, parent in zip([i for i, v in enumerate(genotype) if v>0], parents(genotype)) if parent in previous]
+    return array(bounds).max(axis=0)
+
+
+def stratified_search(fitness_batch, genes, signs, max_k=None, exhaustive=50000, budget=50000, batch_size=2000, verbose=True):
+    # fitness_batch returns the objectives of a list of genotypes, the last being
+    # the complexity (e.g., a Fitness_Cache); signs turn the others into
+    # minimization objectives (see optimization_tools.minimization_signs).
+    # Levels with at most `exhaustive` perturbations are enumerated (exact
+    # front). The others are searched by branch-and-bound within `budget`
+    # evaluations: children of the perturbations of level k-1 (the most
+    # promising first) are evaluated in batches, unless their bound (see
+    # _bound) is dominated by the front of level k found so far. The bound
+    # assumes that adding a target never does better than observed so far on
+    # the evaluated subsets, so these fronts are anytime, not exact.
+    # Returns one dictionary per level with k, exact, evaluated, pruned, total
+    # and the front as a list of (genotype, objectives)
+    signs = array(signs, dtype=float)
+    if max_k is None:
+        max_k = genes
+    previous = {tuple([0]*genes): _evaluate(fitness_batch, [tuple([0]*genes)], signs, batch_size)[0]}
+    gain = full((genes, len(LEVELS), len(signs)), inf)
+    results = []
+    for k in range(1, max_k+1):
+        total = level_size(genes, k)
+        exact = total<=exhaustive
+        level = {}
+        pruned = 0
+        if exact:
+            genotypes = list(level_genotypes(genes, k))
+            level.update(zip(genotypes, _evaluate(fitness_batch, genotypes, signs, batch_size)))
+            _update_gain(gain, level, previous)
+        else:
+            # Most promising parents first: non-dominated, then by sum of the objectives
+            order = list(previous)
+            values = array([previous[g] for g in order])
+            front_mask = nondominated_mask(values)
+            order = [order[i] for i in sorted(range(len(order)), key=lambda i: (not front_mask[i], values[i].sum()))]
+            front = zeros((0, len(signs)))
+            seen = set()
+            step = max(1, batch_size//(2*genes))
+            for start in range(0, len(order), step):
+                if len(level)>=budget:
+                    break
+                candidates = [c for g in order[start:start+step] for c in children(g) if c not in seen]
+                candidates = list(dict.fromkeys(candidates))
+                seen.update(candidates)
+                if not candidates:
+                    continue
+                bounded = dominated(array([_bound(c, previous, gain) for c in candidates]), front)
+                genotypes = [c for c, b in zip(candidates, bounded) if not b][:budget-len(level)]
+                pruned += int(bounded.sum())
+                new = dict(zip(genotypes, _evaluate(fitness_batch, genotypes, signs, batch_size)))
+                level.update(new)
+                _update_gain(gain, new, previous)
+                if new:
+                    front = concatenate([front, array(list(new.values()))])
+                    front = front[nondominated_mask(front)]
+
+        genotypes = list(level)
+        values = array([level[g] for g in genotypes]) if genotypes else zeros((0, len(signs)))
+        mask = nondominated_mask(values)
+        front = [(list(g), (v*signs).tolist()+[k]) for g, v, m in zip(genotypes, values, mask) if m]
+        results.append({"k": k, "exact": exact, "evaluated": len(level), "pruned": pruned, "total": total, "front": front})
+        if verbose:
+            print(" * k=%d: %d of %d perturbations evaluated (%s), %d pruned by the bound, %d on the front" % (k,
+                len(level), total, "exact" if exact else "anytime", pruned, len(front)))
+        previous = level
+    return results
+
+
+def overall_front(results, signs):
+    # Non-dominated perturbations over all the levels (complexity included)
+    front = [entry for result in results for entry in result["front"]]
+    objectives = array([objectives for _, objectives in front])*concatenate([array(signs, dtype=float), [1.0]])
+    return [entry for entry, m in zip(front, nondominated_mask(objectives)) if m]
+
+
+def perturbation_text(genotype, names):
+    return ", ".join("%s IS %s" % (name, LEVELS[v]) for name, v in zip(names, genotype) if v>0)
+
+
+if __name__ == '__main__':
+
+    from three_obj_optimization_programmed_cell_death_comparison import Model_Simulator
+    from optimization_tools import Fitness_Cache
+    from batch_engine import available_backends
+
+    SIM = Model_Simulator()
+    SIM.set_backend(available_backends()[0])
+    CACHE = Fitness_Cache(SIM)
+
+    # Objectives of Model_Simulator.fitness: -change of Apoptosis, change of Necrosis (minimized), complexity
+    SIGNS = [1, 1]
+    results = stratified_search(CACHE, len(SIM._sorted_names), SIGNS)
+    CACHE.report()
+    CACHE.save()
+
+    with open("stratified-front.txt", "w") as fo:
+        for result in results:
+            for genotype, objectives in result["front"]:
+                fo.write("%d\t%s\t%s\t%s\n" % (result["k"], "exact" if result["exact"] else "anytime",
+                    "\t".join("%.4f" % v for v in objectives[:-1]), perturbation_text(genotype, SIM._sorted_names)))
+    front = overall_front(results, SIGNS)
+    print(" * %d perturbations on the overall front" % len(front))
+    savetxt("stratified-fitness.txt", [objectives for _, objectives in front])
+    with open("stratified-paretofront.txt", "w") as fo:
+        for genotype, _ in front:
+            fo.write(perturbation_text(genotype, SIM._sorted_names)+"\n")
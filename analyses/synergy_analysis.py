@@ -0,0 +1,121 @@
+#########################################################################################################
+# Pairwise synergy (epistasis) of the perturbations of the dynamic fuzzy model, for the
+# screening of drug-target combinations: all single perturbations and all the level pairs of
+# two targets (4 per pair of genes) are evaluated as one batch, and the response to each pair
+# is compared to the one expected from the two singles (Bliss independence or additivity).
+#########################################################################################################
+
+from itertools import combinations
+from numpy import array, errstate, full, isnan, nan, savez
+
+LEVELS = {1: "low", 2: "high"}
+
+MODELS = ("bliss", "additive")
+
+
+def combination_genotypes(genes):
+    # Wild type, single perturbations and pairs of perturbations of different
+    # genes, each with its list of (gene, level)
+    combinations_ = [[]]
+    combinations_ += [[(i, level)] for i in range(genes) for level in LEVELS]
+    combinations_ += [[(i, a), (j, b)] for i, j in combinations(range(genes), 2) for a in LEVELS for b in LEVELS]
+    genotypes = []
+    for combination in combinations_:
+        genotype = [0]*genes
+        for gene, level in combination:
+            genotype[gene] = level
+        genotypes.append(genotype)
+    return combinations_, genotypes
+
+
+def expected_response(wild, a, b, model="bliss"):
+    # Response expected for the pair of perturbations with responses a and b,
+    # relative to the wild type. Responses are levels in [0, 1]; Bliss treats
+    # the fractions not responding, (1-a)/(1-wild), as independent
+    if model=="additive":
+        return a+b-wild
+    with errstate(invalid="ignore", divide="ignore"):
+        return 1.-(1.-a)*(1.-b)/(1.-wild)
+
+
+def synergy(fitness_batch, genes, responses, model="bliss"):
+    # responses maps the objectives of fitness_batch (array (N, objectives)) to
+    # the responses (array (N, R)). Returns a dictionary with the responses of
+    # the wild type ("wild", R), of the singles ("singles", (genes, 2, R)) and
+    # of the pairs ("pairs", (genes, 2, genes, 2, R), symmetric), and the
+    # interaction scores observed-expected ("scores", same shape as pairs; nan
+    # for pairs of the same gene). Levels are indexed as LEVELS (0: low, 1: high)
+    if model not in MODELS:
+        raise Exception("ERROR: unknown synergy model '%s', use %s" % (model, " or ".join(MODELS)))
+    combinations_, genotypes = combination_genotypes(genes)
+    values = array(responses(fitness_batch(genotypes)), dtype=float)
+    R = values.shape[1]
+    wild = values[0]
+    singles = full((genes, 2, R), nan)
+    pairs = full((genes, 2, genes, 2, R), nan)
+    for combination, value in zip(combinations_, values):
+        if len(combination)==1:
+            (i, a), = combination
+            singles[i, a-1] = value
+        elif len(combination)==2:
+            (i, a), (j, b) = combination
+            pairs[i, a-1, j, b-1] = pairs[j, b-1, i, a-1] = value
+    expected = expected_response(wild, singles[:, :, None, None, :], singles[None, None, :, :, :], model)
+    return {"model": model, "wild": wild, "singles": singles, "pairs": pairs, "scores": pairs-expected}
+
+
+def ranked_interactions(result, names, response_names):
+    # List of (score, response, "A IS level + B IS level", observed, expected)
+    # for every pair of perturbations, from the strongest synergy to the
+    # strongest antagonism of each response
+    scores, pairs = result["scores"], result["pairs"]
+    ranking = []
+    for r, response in enumerate(response_names):
+        entries = []
+        for i, j in combinations(range(len(names)), 2):
+            for a in LEVELS:
+                for b in LEVELS:
+                    score = scores[i, a-1, j, b-1, r]
+                    if not isnan(score):
+                        entries.append((score, response, "%s IS %s + %s IS %s" % (names[i], LEVELS[a], names[j], LEVELS[b]),
+                            pairs[i, a-1, j, b-1, r], pairs[i, a-1, j, b-1, r]-score))
+        ranking.extend(sorted(entries, key=lambda entry: -entry[0]))
+    return ranking
+
+
+def save_synergy(result, names, response_names, prefix="synergy"):
+    # Arrays in <prefix>_<model>.npz, ranked list in <prefix>_<model>_ranked.txt
+    filename = "%s_%s" % (prefix, result["model"])
+    savez(filename+".npz", names=array(names), responses=array(response_names), levels=array(list(LEVELS.values())),
+        wild=result["wild"], singles=result["singles"], pairs=result["pairs"], scores=result["scores"])
+    with open(filename+"_ranked.txt", "w") as fo:
+        for score, response, pair, observed, expected in ranked_interactions(result, names, response_names):
+            fo.write("%s\t%s\t%+.4f\t%.4f\t%.4f\n" % (response, pair, score, observed, expected))
+
+
+if __name__ == '__main__':
+
+    from three_obj_optimization_programmed_cell_death_comparison import Model_Simulator
+    from optimization_tools import Fitness_Cache
+    from batch_engine import available_backends
+
+    SIM = Model_Simulator()
+    SIM.set_backend(available_backends()[0])
+    CACHE = Fitness_Cache(SIM)
+
+    # Objectives of Model_Simulator.fitness: -change of Apoptosis, change of
+    # Necrosis, complexity. Both start at 0, so the changes are the levels
+    RESPONSES = ["Apoptosis", "Necrosis"]
+    responses = lambda values: values[:, :2]*[-1, 1]
+
+    for model in MODELS:
+        result = synergy(CACHE, len(SIM._sorted_names), responses, model)
+        save_synergy(result, SIM._sorted_names, RESPONSES)
+        ranking = ranked_interactions(result, SIM._sorted_names, RESPONSES)
+        for response in RESPONSES:
+            entries = [entry for entry in ranking if entry[1]==response]
+            print(" * %s synergies (%s):" % (response, model))
+            for score, _, pair, observed, expected in entries[:5]:
+                print("    %s: %+.4f (observed %.4f, expected %.4f)" % (pair, score, observed, expected))
+    CACHE.report()
+    CACHE.save()